@@ -1,6 +1,11 @@
+from typing import List
+
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dbsql.llm.chains.dbsql_answer import DBSQLAnswer
+from dbsql.server.routers import metrics
+from dbsql.server.sse import sse_response
 import uvicorn
 # 新增 CORS 中间件
 from fastapi.middleware.cors import CORSMiddleware  # <-- 添加这一行
@@ -16,6 +21,9 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有请求头
 )
 
+# Prometheus 格式的运行指标 /metrics
+app.include_router(metrics.router)
+
 # 初始化数据库处理器
 db_handler = DBSQLAnswer(
     model="local",
@@ -30,6 +38,12 @@ db_handler = DBSQLAnswer(
 class QuestionRequest(BaseModel):
     question: str
 
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    max_concurrency: int = 4
+
+MAX_BATCH_QUESTIONS = 100
+
 @app.post("/ask", response_model=str)
 async def simple_chat(request: QuestionRequest):
     """
@@ -39,7 +53,7 @@ async def simple_chat(request: QuestionRequest):
     """
     try:
         # 调用核心处理逻辑
-        _, response = db_handler.step_run(question=request.question)
+        _, response = await db_handler.astep_run(question=request.question)
         
         # 返回最终答案字符串
         return response
@@ -51,5 +65,38 @@ async def simple_chat(request: QuestionRequest):
             detail=f"处理失败: {str(e)}"
         )
 
+@app.post("/ask/stream")
+async def stream_chat(request: QuestionRequest):
+    """
+    流式问答接口 (Server-Sent Events)
+    依次推送: tables, sql, result, token..., done
+    """
+    return sse_response(db_handler.astep_stream(question=request.question))
+
+@app.post("/ask/batch")
+async def batch_chat(request: BatchQuestionRequest):
+    """
+    批量问答接口
+    输入: 问题列表
+    输出: 按输入顺序的 {question, answer, error} 列表
+    """
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一次最多 {MAX_BATCH_QUESTIONS} 个问题"
+        )
+    max_concurrency = min(max(request.max_concurrency, 1), 16)
+    # the batch blocks on the LLM and the database, keep it off the event loop
+    results = await run_in_threadpool(
+        db_handler.step_run_batch, request.questions, max_concurrency=max_concurrency
+    )
+    items = []
+    for question, result in zip(request.questions, results):
+        if isinstance(result, Exception):
+            items.append({"question": question, "answer": None, "error": f"处理失败: {str(result)}"})
+        else:
+            items.append({"question": question, "answer": result[1], "error": None})
+    return items
+
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=12256)
\ No newline at end of file
@@ -4,6 +4,8 @@ from typing import Optional, Iterable, List, Union, Literal, Dict, Any, Sequence
 
 import dmPython
 
+from dbsql.pool import ConnectionPool, PoolStats
+
 
 class DMDatabase:
     def __init__(
@@ -15,6 +17,9 @@ class DMDatabase:
             database: str = 'DMHR',
             sample_rows_in_table_info: int = 3,
             indexes_in_table_info: bool = False,
+            pool_size: int = 5,
+            pool_timeout: float = 30.0,
+            pool_max_idle_time: float = 300.0,
     ):
         self.user = user
         self.password = password
@@ -28,6 +33,14 @@ class DMDatabase:
         self._sample_rows_in_table_info = sample_rows_in_table_info
         self._indexes_in_table_info = indexes_in_table_info
 
+        self._pool = ConnectionPool(
+            self._connect,
+            max_size=pool_size,
+            acquire_timeout=pool_timeout,
+            max_idle_time=pool_max_idle_time,
+            health_check_query="SELECT 1 FROM DUAL",
+        )
+
         self._tables = self._get_tables()
         self._history = list()
 
@@ -102,6 +115,31 @@ class DMDatabase:
         """
         return self.get_usable_table_names()
 
+    def _connect(self):
+        return dmPython.connect(
+            user=self.user,
+            password=self.password,
+            server=self.host,
+            port=self.port
+        )
+
+    def pool_stats(self) -> PoolStats:
+        """get statistics of the connection pool.
+
+        Returns:
+            PoolStats: in use, idle, waiting and created connection counts.
+
+        Examples:
+            >>> dmdb = DMDatabase()
+            >>> dmdb.pool_stats()
+            PoolStats(max_size=5, size=1, idle=1, in_use=0, waiting=0, created=1, closed=0, timeouts=0)
+        """
+        return self._pool.stats()
+
+    def close(self) -> None:
+        """close all pooled connections"""
+        self._pool.close()
+
     def _get_tables(self):
         """get the names of the tables in the database
 
@@ -276,29 +314,23 @@ class DMDatabase:
             execution_options: Optional[Dict[str, Any]] = None,
     ):
         try:
-            connection = dmPython.connect(
-                user=self.user,
-                password=self.password,
-                server=self.host,
-                port=self.port
-            )
-            cursor = connection.cursor()
-
-            cursor.execute(command)
-
-            if fetch == "all":
-                result = cursor.fetchall()
-            elif fetch == "one":
-                result = cursor.fetchone()
-            elif fetch == "cursor":
-                result = cursor
-            else:
-                raise ValueError(
-                    "Fetch parameter must be either 'one', 'all', or 'cursor'"
-                )
-
-            cursor.close()
-            connection.close()
+            with self._pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(command)
+
+                    if fetch == "all":
+                        result = cursor.fetchall()
+                    elif fetch == "one":
+                        result = cursor.fetchone()
+                    elif fetch == "cursor":
+                        result = cursor
+                    else:
+                        raise ValueError(
+                            "Fetch parameter must be either 'one', 'all', or 'cursor'"
+                        )
+                finally:
+                    cursor.close()
 
             return result
 
@@ -0,0 +1,111 @@
+"""数据库调用的异步接口 (有界线程池)"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Literal, Optional
+
+from dbsql.result import QueryResult
+from dbsql.timeout import CancelToken
+
+
+class AsyncExecutionMixin:
+    """coroutine versions of ``run`` / ``_execute`` / ``query`` for blocking DB drivers.
+
+    Calls are handed to a dedicated executor with ``_executor_workers`` threads
+    (the size of the connection pool), so the event loop is never blocked and at
+    most as many statements run at once as there are pooled connections; extra
+    calls wait in the executor queue instead of holding a thread while they wait
+    for a connection.
+
+    Examples:
+        >>> result = await db.aquery("SELECT COUNT(*) FROM XYCS.EGOV_DISPATCH")
+        >>> text = await db.arun("SELECT * FROM XYCS.EGOV_DISPATCH")
+    """
+    _executor_workers: int = 5
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._executor_workers,
+                        thread_name_prefix=f"{type(self).__name__.lower()}-query",
+                    )
+        return self._executor
+
+    async def _in_executor(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def arun(
+            self,
+            command: str,
+            fetch: Literal["all", "one", "cursor"] = "all",
+            include_columns: bool = False,
+            *,
+            parameters: Optional[Any] = None,
+            execution_options: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """awaitable ``run``"""
+        return await self._in_executor(
+            self.run,
+            command,
+            fetch,
+            include_columns,
+            parameters=parameters,
+            execution_options=execution_options,
+        )
+
+    async def aexecute(
+            self,
+            command: str,
+            fetch: Literal["all", "one"] = "all",
+            *,
+            parameters: Optional[Any] = None,
+            execution_options: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """awaitable ``_execute``, returning the raw rows"""
+        if fetch not in ("all", "one"):
+            raise ValueError("Fetch parameter must be either 'one' or 'all'")
+        return await self._in_executor(
+            self._execute,
+            command,
+            fetch,
+            parameters=parameters,
+            execution_options=execution_options,
+        )
+
+    async def aquery(
+            self,
+            command: str,
+            max_rows: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+            *,
+            parameters: Optional[Any] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None,
+    ) -> QueryResult:
+        """awaitable ``query``. The statement keeps its own timeout, so a cancelled
+        caller does not leave it running for longer than ``timeout`` seconds; use
+        ``cancel_token`` to stop it earlier."""
+        return await self._in_executor(
+            self.query,
+            command,
+            max_rows,
+            max_bytes,
+            parameters=parameters,
+            timeout=timeout,
+            cancel_token=cancel_token,
+        )
+
+    def shutdown_executor(self, wait: bool = True) -> None:
+        """stop the executor threads, a new executor is created on the next async call"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
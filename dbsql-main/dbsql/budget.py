@@ -0,0 +1,205 @@
+"""Prompt 上下文的 token 预算 (表结构裁剪 / 查询结果摘要)"""
+from __future__ import annotations
+
+import decimal
+import re
+import threading
+from collections import Counter
+from typing import Any, List
+
+from dbsql import logger
+from dbsql.metrics import PROMPT_TOKENS
+from dbsql.render import format_value
+from dbsql.result import QueryResult
+from dbsql.routing import tokenize
+
+try:
+    import tiktoken
+except ImportError:  # the heuristic below is close enough to size prompts
+    tiktoken = None
+
+_CJK = re.compile(r"[一-鿿]")
+# the /* indexes and sample rows */ block of get_table_info
+_COMMENT_BLOCK = re.compile(r"\n*/\*.*?\*/", re.DOTALL)
+_TOP_VALUES = re.compile(r", 常见值: [^\n]*")
+_COLUMN_LINE = re.compile(r"^- ([^:\n]+):", re.MULTILINE)
+_TRUNCATED = "\n...(truncated)\n"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, tiktoken
+    with _encoding_lock:
+        if _encoding is None and tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as error:
+                # the encoding file is downloaded on first use, which fails offline
+                logger.warning(f"tiktoken unavailable, estimate token counts: {error}")
+                tiktoken = None
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """tokens of ``text``, with tiktoken when available, estimated otherwise"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def log_tokens(stage: str, text: str) -> int:
+    tokens = count_tokens(text)
+    logger.info(f"prompt tokens [{stage}]: {tokens}")
+    PROMPT_TOKENS.inc(tokens, stage=stage)
+    return tokens
+
+
+def prompt_logger(stage: str):
+    """chain step logging the tokens of the prompt passing through it"""
+    def _log(prompt: Any) -> Any:
+        log_tokens(stage, prompt.to_string() if hasattr(prompt, "to_string") else str(prompt))
+        return prompt
+
+    return _log
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """the longest prefix of ``text`` within ``max_tokens``, marked as truncated"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle] + _TRUNCATED) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + _TRUNCATED
+
+
+class TokenBudget:
+    """keeps the schema and result context of the prompts within a token budget.
+
+    Schema fragments are reduced step by step until they fit: first the sample
+    rows, indexes and common values go, then the column descriptions that share
+    nothing with the question (the DDL still lists every column), and as a last
+    resort every fragment is cut to its share of the budget. Results over budget
+    keep their first rows plus per-column statistics of all rows.
+
+    Args:
+        schema_tokens: budget of ``table_info`` in TABLE_PROMPT / QUESTION_PROMPT / REPAIR_PROMPT.
+        result_tokens: budget of ``sql_result`` in ANSWER_PROMPT.
+        min_columns: column descriptions kept per table even when none matches the question.
+
+    Examples:
+        >>> budget = TokenBudget(schema_tokens=4000, result_tokens=1500)
+        >>> table_info = budget.fit_schema(question, fragments.pieces(["虚假宣传"]))
+        >>> sql_result = budget.fit_result(result)
+    """
+
+    def __init__(self, schema_tokens: int = 6000, result_tokens: int = 2000, min_columns: int = 5):
+        self.schema_tokens = schema_tokens
+        self.result_tokens = result_tokens
+        self.min_columns = min_columns
+
+    def fit_schema(self, question: str, fragments: List[str], stage: str = "schema") -> str:
+        """join ``fragments`` into ``table_info`` of at most ``schema_tokens`` tokens"""
+        table_info = "".join(fragments)
+        tokens = count_tokens(table_info)
+        if tokens <= self.schema_tokens:
+            logger.info(f"prompt tokens [{stage}]: {tokens}")
+            return table_info
+
+        steps = [
+            ("trim sample rows", lambda fragment: _TOP_VALUES.sub("", _COMMENT_BLOCK.sub("", fragment))),
+            ("drop low-relevance columns", lambda fragment: self._relevant_columns(question, fragment)),
+        ]
+        for name, step in steps:
+            fragments = [step(fragment) for fragment in fragments]
+            table_info = "".join(fragments)
+            reduced = count_tokens(table_info)
+            logger.info(f"prompt tokens [{stage}]: {tokens} -> {reduced} after {name}")
+            tokens = reduced
+            if tokens <= self.schema_tokens:
+                return table_info
+
+        share = self.schema_tokens // max(len(fragments), 1)
+        table_info = "".join(truncate_tokens(fragment, share) for fragment in fragments)
+        logger.warning(f"prompt tokens [{stage}]: {tokens} -> {count_tokens(table_info)} after truncation")
+        return table_info
+
+    def fit_result(self, result: QueryResult, stage: str = "result") -> str:
+        """``result.to_text()`` within ``result_tokens``, summarized when it is larger"""
+        text = result.to_text()
+        tokens = count_tokens(text)
+        if tokens <= self.result_tokens:
+            logger.info(f"prompt tokens [{stage}]: {tokens}")
+            return text
+
+        summary = self._column_summary(result)
+        low, high = 0, result.row_count
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(self._head(result, middle, summary)) <= self.result_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        text = truncate_tokens(self._head(result, low, summary), self.result_tokens)
+        logger.info(f"prompt tokens [{stage}]: {tokens} -> {count_tokens(text)}, {low} of {result.row_count} rows kept")
+        return text
+
+    def _relevant_columns(self, question: str, fragment: str) -> str:
+        """drop ``- column: description`` lines sharing no term with the question,
+        keeping at least ``min_columns`` of them"""
+        terms = set(tokenize(question))
+        lines = fragment.split("\n")
+        column_lines = [i for i, line in enumerate(lines) if _COLUMN_LINE.match(line)]
+        if len(column_lines) <= self.min_columns:
+            return fragment
+        relevant = [i for i in column_lines if terms & set(tokenize(lines[i]))]
+        keep = set(relevant)
+        for i in column_lines:
+            if len(keep) >= self.min_columns:
+                break
+            keep.add(i)
+        return "\n".join(line for i, line in enumerate(lines) if i not in column_lines or i in keep)
+
+    @staticmethod
+    def _head(result: QueryResult, rows: int, summary: str) -> str:
+        head = QueryResult(result.columns, result.rows[:rows], rows)
+        lines = head.to_text().split("\n")[:-1]
+        shown = f"{rows} of {result.row_count} rows shown"
+        if result.truncated:
+            shown += ", the query returned more rows than were fetched"
+        lines.append(f"({shown})")
+        lines.append(summary)
+        return "\n".join(lines)
+
+    @staticmethod
+    def _column_summary(result: QueryResult) -> str:
+        """statistics of every column over all fetched rows"""
+        lines = ["column summary:"]
+        for index, column in enumerate(result.columns):
+            values = [row[index] for row in result.rows if row[index] is not None]
+            numbers = [value for value in values if _is_number(value)]
+            if values and len(numbers) == len(values):
+                total = sum(numbers)
+                lines.append(
+                    f"- {column}: min {format_value(min(numbers))}, max {format_value(max(numbers))}, "
+                    f"sum {format_value(total)}, avg {format_value(total / len(numbers))}"
+                )
+            else:
+                top = Counter(format_value(value)[:30] for value in values).most_common(5)
+                lines.append(
+                    f"- {column}: {len(set(map(str, values)))} distinct, "
+                    + ", ".join(f"{value}({count})" for value, count in top)
+                )
+        return "\n".join(lines)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)
@@ -0,0 +1,144 @@
+"""问答结果缓存 (内存 LRU + 可选磁盘层)"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dbsql import logger
+from dbsql.metrics import record_cache
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？.。!！~～ "
+
+
+def normalize_question(question: str) -> str:
+    """fold full-width characters, case and whitespace so that trivially
+    different spellings of a question share one cache entry"""
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = _SPACES.sub(" ", question).strip()
+    return question.rstrip(_TRAILING_PUNCTUATION)
+
+
+class AnswerCache:
+    """cache of ``(process, answer)`` pairs produced by ``DBSQLAnswer.step_run``.
+
+    Entries are keyed on the normalized question, the model and a version
+    string (schema / data version), so changing any of them misses the cache.
+    The memory tier is an LRU of ``max_entries`` items; when ``path`` is given
+    every entry is also written there as one json file, which survives restarts
+    and is shared between processes.
+
+    Args:
+        max_entries: size of the in-memory LRU, 0 to disable the memory tier.
+        path: directory of the on-disk tier, None to keep entries in memory only.
+        ttl: seconds an entry stays valid, None to never expire.
+
+    Examples:
+        >>> cache = AnswerCache(max_entries=256, path="data/answer_cache")
+        >>> key = cache.key("各类投诉数量", "local", "v1")
+        >>> cache.set(key, ("...process...", "共 5 类投诉"))
+        >>> cache.get(key)
+        ('...process...', '共 5 类投诉')
+        >>> cache.invalidate()
+    """
+
+    def __init__(self, max_entries: int = 256, path: Optional[str] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[float, Tuple[str, str]]] = OrderedDict()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(question: str, model: str, version: str = "") -> str:
+        raw = "\x1f".join((model, version, normalize_question(question)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache("answer", hit=True)
+                return entry[1]
+
+        entry = self._read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                record_cache("answer", hit=False)
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+        record_cache("answer", hit=True)
+        return entry[1]
+
+    def set(self, key: str, value: Tuple[str, str]) -> None:
+        entry = (time.time(), tuple(value))
+        with self._lock:
+            self._remember(key, entry)
+        self._write(key, entry)
+
+    def invalidate(self) -> None:
+        """drop every entry of both tiers, e.g. after new data was imported"""
+        with self._lock:
+            self._entries.clear()
+        if self.path is None:
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def _remember(self, key: str, entry: Tuple[float, Tuple[str, str]]) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[Tuple[float, Tuple[str, str]]]:
+        if self.path is None or not os.path.exists(self._file(key)):
+            return None
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as error:
+            logger.warning(f"ignore unreadable answer cache entry {key}: {error}")
+            return None
+        if self._expired(data["created_at"]):
+            return None
+        return data["created_at"], (data["process"], data["answer"])
+
+    def _write(self, key: str, entry: Tuple[float, Tuple[str, str]]) -> None:
+        if self.path is None:
+            return
+        created_at, (process, answer) = entry
+        tmp_path = f"{self._file(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": created_at, "process": process, "answer": answer}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._file(key))
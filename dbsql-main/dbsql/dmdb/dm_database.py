@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import re
+import time
+from collections import defaultdict
+from contextlib import nullcontext
 from copy import copy
 from typing import Optional, Iterable, List, Union, Literal, Dict, Any, Sequence
 
@@ -8,8 +11,17 @@ import dmPython
 from langchain_community.utilities import SQLDatabase
 from langchain_core._api import deprecated
 
+from dbsql.aio import AsyncExecutionMixin
+from dbsql.pool import ConnectionPool, PoolStats
+from dbsql.result import QueryResult, RowStream
+from dbsql.result_cache import ResultCache
+from dbsql.schema_cache import SchemaCache
+from dbsql.timeout import CancelToken, StatementTimer
 
-class DMDatabase(SQLDatabase):
+Parameters = Union[Sequence[Any], Dict[str, Any]]
+
+
+class DMDatabase(AsyncExecutionMixin, SQLDatabase):
     def __init__(
             self,
             user: str = 'SYSDBA',
@@ -19,6 +31,16 @@ class DMDatabase(SQLDatabase):
             database: str = 'DMHR',
             sample_rows_in_table_info: int = 3,
             indexes_in_table_info: bool = False,
+            pool_size: int = 5,
+            pool_timeout: float = 30.0,
+            pool_max_idle_time: float = 300.0,
+            schema_cache_ttl: Optional[float] = 3600.0,
+            schema_cache_path: Optional[str] = None,
+            fetch_batch_size: int = 500,
+            max_result_rows: Optional[int] = 200,
+            max_result_bytes: Optional[int] = 64 * 1024,
+            statement_timeout: Optional[float] = 30.0,
+            result_cache: Optional[ResultCache] = None,
     ):
         self.user = user
         self.password = password
@@ -31,14 +53,56 @@ class DMDatabase(SQLDatabase):
 
         self._sample_rows_in_table_info = sample_rows_in_table_info
         self._indexes_in_table_info = indexes_in_table_info
+        self._fetch_batch_size = fetch_batch_size
+        self._max_result_rows = max_result_rows
+        self._max_result_bytes = max_result_bytes
+        self._statement_timeout = statement_timeout
+        self._result_cache = result_cache
+        # async calls run on one executor thread per pooled connection
+        self._executor_workers = pool_size
+
+        self._pool = ConnectionPool(
+            self._connect,
+            max_size=pool_size,
+            acquire_timeout=pool_timeout,
+            max_idle_time=pool_max_idle_time,
+            health_check_query="SELECT 1 FROM DUAL",
+        )
+        self._schema_cache = SchemaCache(ttl=schema_cache_ttl, path=schema_cache_path)
 
         # self._tables = self._get_tables()
         self._tables = ['EGOV_DISPATCH', 'EGOV_COMMON_OPINION', 'RMS_UPDATE_DETAIL_LOG']
 
+    def _connect(self):
+        return dmPython.connect(
+            user=self.user,
+            password=self.password,
+            server=self.host,
+            port=self.port
+        )
+
+    def pool_stats(self) -> PoolStats:
+        """connection pool statistics (in use, waiting, created, ...)"""
+        return self._pool.stats()
+
+    def close(self) -> None:
+        """stop the async executor and close all pooled connections"""
+        self.shutdown_executor(wait=False)
+        self._pool.close()
+
+    def invalidate_schema_cache(self, table_names: Optional[List[str]] = None) -> None:
+        """drop cached DDL, columns and sample rows of ``table_names`` (all tables when None)"""
+        keys = None if table_names is None else [self._cache_key(table) for table in table_names]
+        self._schema_cache.invalidate(keys)
+
+    def _cache_key(self, table: str) -> str:
+        return f"{self.database}.{table}"
+
     def _get_tables(self):
         tables = self._execute(
-            command=f"SELECT TABLE_NAME FROM dba_tables WHERE OWNER='{self.database}';",
-            fetch="all"
+            command="SELECT TABLE_NAME FROM dba_tables WHERE OWNER=?;",
+            fetch="all",
+            parameters=(self.database,)
         )
         return [table[0] for table in tables]
 
@@ -104,6 +168,7 @@ class DMDatabase(SQLDatabase):
             for table in self._tables
             if table in set(all_table_names)
         ]
+        self.preload_schema(meta_tables)
 
         tables = []
         for table in meta_tables:
@@ -126,24 +191,119 @@ class DMDatabase(SQLDatabase):
         final_str = "\n\n".join(tables)
         return final_str
 
+    def get_table_ddl(self, table: str) -> str:
+        """the CREATE TABLE statement of ``table``, without sample rows"""
+        return self._get_table_structure(table).rstrip()
+
+    def preload_schema(self, table_names: Optional[Iterable[str]] = None) -> None:
+        """load the DDL and columns of every uncached table of ``table_names`` (all
+        usable tables when None) in one catalog round trip, instead of one per table"""
+        self._load_catalog(list(self._tables if table_names is None else table_names))
+
+    def _load_catalog(self, tables: List[str]) -> None:
+        """cache columns and compact DDL of every uncached table in ``tables``
+        with one query on all_tab_columns/all_col_comments and one on all_tab_comments.
+
+        The compact DDL is the only DDL format: the prompts and the ddl fingerprints
+        of the table descriptions must not depend on which path loaded a table."""
+        tables = [
+            table for table in tables
+            if any(self._schema_cache.get(self._cache_key(table), kind) is None for kind in ("catalog_ddl", "columns"))
+        ]
+        if not tables:
+            return
+
+        table_list = ", ".join("?" for _ in tables)
+        column_rows = self._execute(
+            command=(
+                "SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.DATA_LENGTH, c.DATA_PRECISION, "
+                "c.DATA_SCALE, c.NULLABLE, m.COMMENTS "
+                "FROM all_tab_columns c LEFT JOIN all_col_comments m "
+                "ON m.OWNER = c.OWNER AND m.TABLE_NAME = c.TABLE_NAME AND m.COLUMN_NAME = c.COLUMN_NAME "
+                f"WHERE c.OWNER = ? AND c.TABLE_NAME IN ({table_list}) "
+                "ORDER BY c.TABLE_NAME, c.COLUMN_ID"
+            ),
+            fetch="all",
+            parameters=(self.database, *tables)
+        )
+        table_comments = dict(self._execute(
+            command=(
+                "SELECT TABLE_NAME, COMMENTS FROM all_tab_comments "
+                f"WHERE OWNER = ? AND TABLE_NAME IN ({table_list})"
+            ),
+            fetch="all",
+            parameters=(self.database, *tables)
+        ))
+
+        columns = defaultdict(list)
+        for table, *column in column_rows:
+            columns[table].append(column)
+
+        self._schema_cache.update({
+            self._cache_key(table): {
+                "catalog_ddl": self._build_ddl(table, table_columns, table_comments.get(table)),
+                "columns": [column[0] for column in table_columns],
+            }
+            for table, table_columns in columns.items()
+        })
+
+    def _build_ddl(self, table: str, columns: List[list], comment: Optional[str] = None) -> str:
+        """rebuild a compact CREATE TABLE statement from catalog rows of
+        (name, type, length, precision, scale, nullable, comment)"""
+        lines = []
+        for name, data_type, length, precision, scale, nullable, column_comment in columns:
+            if precision is not None and data_type in ("DECIMAL", "NUMBER", "NUMERIC", "DEC"):
+                data_type = f"{data_type}({precision},{scale or 0})"
+            elif length and data_type in ("CHAR", "VARCHAR", "VARCHAR2", "CHARACTER", "NCHAR", "NVARCHAR"):
+                data_type = f"{data_type}({length})"
+            line = f'"{name}" {data_type}'
+            if nullable == "N":
+                line += " NOT NULL"
+            if column_comment:
+                line += f" COMMENT '{column_comment}'"
+            lines.append(line)
+
+        ddl = f'CREATE TABLE "{self.database}"."{table}"\n(\n' + ",\n".join(lines) + "\n)"
+        if comment:
+            ddl += f" COMMENT '{comment}'"
+        return ddl + ";"
+
     def _get_table_structure(self, table_name: str) -> str:
-        return self._execute(
-            command=f"SELECT DBMS_METADATA.GET_DDL('TABLE','{table_name}','{self.database}') FROM dual;",
-            fetch="all"
-        )[0][0]
+        return self._catalog_entry(table_name, "catalog_ddl")
+
+    def _catalog_entry(self, table: str, kind: str) -> Any:
+        value = self._schema_cache.get(self._cache_key(table), kind)
+        if value is None:
+            self._load_catalog([table])
+            value = self._schema_cache.get(self._cache_key(table), kind)
+        if value is None:
+            raise ValueError(f"table {table} not found in {self.database}")
+        return value
 
     def _get_table_indexes(self, table: str) -> str:
         raise NotImplementedError
 
-    def _get_sample_rows(self, table: str) -> str:
-        columns_name = self._execute(
-            f"select COLUMN_NAME from all_tab_columns where owner='{self.database}' and Table_Name='{table}'")
-        columns_str = "\t".join([column_name[0] for column_name in columns_name])
+    def get_table_columns(self, table: str) -> List[str]:
+        """column names of ``table`` in definition order"""
+        return list(self._get_table_columns(table))
 
-        sample_rows_result = self._execute(
-            command=f'SELECT * FROM {self.database}."{table}" LIMIT {self._sample_rows_in_table_info};'
+    def _get_table_columns(self, table: str) -> List[str]:
+        return self._catalog_entry(table, "columns")
+
+    def _get_sample_rows(self, table: str) -> str:
+        columns_str = "\t".join(self._get_table_columns(table))
+
+        sample_rows = self._schema_cache.get_or_load(
+            self._cache_key(table), f"sample_rows:{self._sample_rows_in_table_info}",
+            lambda: [
+                [str(item) for item in row] for row in self._execute(
+                    # identifiers cannot be bound, but the text is constant per table so it stays prepared
+                    command=f'SELECT * FROM {self.database}."{table}" LIMIT {self._sample_rows_in_table_info};',
+                    parameters=()
+                )
+            ]
         )
-        sample_rows_str = "\n".join(["\t".join([str(item) for item in row]) for row in sample_rows_result])
+        sample_rows_str = "\n".join(["\t".join(row) for row in sample_rows])
 
         return (
             f"{self._sample_rows_in_table_info} rows from {table} table:\n"
@@ -156,38 +316,109 @@ class DMDatabase(SQLDatabase):
             command: str,
             fetch: Literal["all", "one", "cursor"] = "all",
             *,
-            parameters: Optional[Dict[str, Any]] = None,
+            parameters: Optional[Parameters] = None,
             execution_options: Optional[Dict[str, Any]] = None,
     ):
-        # try:
-        connection = dmPython.connect(
-            user=self.user,
-            password=self.password,
-            server=self.host,
-            port=self.port
-        )
-        cursor = connection.cursor()
-
-        cursor.execute(command)
-
-        if fetch == "all":
-            result = cursor.fetchall()
-        elif fetch == "one":
-            result = cursor.fetchone()
-        elif fetch == "cursor":
-            result = cursor
-        else:
+        """execute ``command`` on a pooled connection.
+
+        When ``parameters`` is given (a sequence for ``?`` placeholders or a dict for
+        ``:name`` placeholders, possibly empty) the statement is executed as a bind
+        query on a prepared cursor cached per connection, so repeated templates are
+        parsed once per connection.
+        """
+        if fetch == "cursor":
+            return self.stream(command, parameters=parameters)
+        if fetch not in ("all", "one"):
             raise ValueError(
                 "Fetch parameter must be either 'one', 'all', or 'cursor'"
             )
 
-        cursor.close()
-        connection.close()
+        with self._pool.connection() as connection:
+            if parameters is None:
+                cursor = connection.cursor()
+                try:
+                    with StatementTimer(self._statement_timeout, connection.cancel):
+                        cursor.execute(command)
+                        result = cursor.fetchall() if fetch == "all" else cursor.fetchone()
+                finally:
+                    cursor.close()
+                return result
+
+            statements = connection.statements
+            cursor = statements.cursor(command)
+            try:
+                with StatementTimer(self._statement_timeout, connection.cancel):
+                    cursor.execute(command, parameters)
+                    result = cursor.fetchall() if fetch == "all" else cursor.fetchone()
+            except BaseException:
+                statements.discard(command)
+                raise
+            finally:
+                if statements.size == 0:
+                    cursor.close()
 
         return result
 
-        # except dmPython.Error as error:
-        #     return str(error)
+    def stream(
+            self,
+            command: str,
+            batch_size: Optional[int] = None,
+            parameters: Optional[Parameters] = None,
+    ) -> RowStream:
+        """stream the rows of ``command`` in ``fetchmany`` batches from a live pooled
+        connection, which is released when iteration ends or the stream is closed"""
+        return RowStream(
+            self._pool,
+            command.strip("\n"),
+            parameters=parameters,
+            batch_size=batch_size or self._fetch_batch_size,
+        )
+
+    def result_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """hit / miss counts and size of the SQL result cache, None when disabled"""
+        return None if self._result_cache is None else self._result_cache.stats()
+
+    def query(
+            self,
+            command: str,
+            max_rows: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+            *,
+            parameters: Optional[Parameters] = None,
+            timeout: Optional[float] = None,
+            cancel_token: Optional[CancelToken] = None,
+    ) -> QueryResult:
+        """run ``command`` and return a structured result holding at most ``max_rows``
+        rows and ``max_bytes`` bytes. The statement is cancelled on the server and
+        QueryTimeout raised after ``timeout`` seconds, or when ``cancel_token`` is
+        cancelled. Instance defaults apply when None; limit hits are reported in
+        ``result.metadata``."""
+        max_rows = self._max_result_rows if max_rows is None else max_rows
+        max_bytes = self._max_result_bytes if max_bytes is None else max_bytes
+        timeout = self._statement_timeout if timeout is None else timeout
+        batch_size = self._fetch_batch_size if max_rows is None else min(self._fetch_batch_size, max_rows + 1)
+
+        cache_key = None
+        if self._result_cache is not None and parameters is None:
+            cache_key = self._result_cache.key(command, max_rows, max_bytes)
+            cached = None if cache_key is None else self._result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        start = time.perf_counter()
+        with self.stream(command, batch_size=batch_size, parameters=parameters) as rows, \
+                StatementTimer(timeout, rows.cancel), \
+                (cancel_token.bind(rows.cancel) if cancel_token is not None else nullcontext()):
+            result = QueryResult.collect(rows.columns, rows.batches(), max_rows, max_bytes)
+        result.metadata.update(
+            elapsed=round(time.perf_counter() - start, 3),
+            timeout=timeout,
+            row_limit_hit=result.truncated_by == "rows",
+            byte_limit_hit=result.truncated_by == "bytes",
+        )
+        if cache_key is not None:
+            self._result_cache.set(cache_key, result)
+        return result
 
     def run(
             self,
@@ -195,9 +426,19 @@ class DMDatabase(SQLDatabase):
             fetch: Literal["all", "one", "cursor"] = "all",
             include_columns: bool = False,
             *,
-            parameters: Optional[Dict[str, Any]] = None,
+            parameters: Optional[Parameters] = None,
             execution_options: Optional[Dict[str, Any]] = None,
     ):
+        if fetch == "all":
+            options = execution_options or dict()
+            return self.query(
+                command,
+                max_rows=options.get("max_rows"),
+                max_bytes=options.get("max_bytes"),
+                parameters=parameters,
+                timeout=options.get("timeout"),
+            ).to_text()
+
         result = self._execute(
             command.strip("\n"), fetch, parameters=parameters, execution_options=execution_options
         )
@@ -220,7 +461,7 @@ class DMDatabase(SQLDatabase):
             fetch: Literal["all", "one"] = "all",
             include_columns: bool = False,
             *,
-            parameters: Optional[Dict[str, Any]] = None,
+            parameters: Optional[Parameters] = None,
             execution_options: Optional[Dict[str, Any]] = None,
     ) -> Union[str, Sequence[Dict[str, Any]]]:
         try:
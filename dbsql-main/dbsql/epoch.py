@@ -0,0 +1,34 @@
+"""数据版本号 (data epoch): 导入新数据后递增, 用于使各类缓存失效"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Optional
+
+DEFAULT_EPOCH_FILE = os.path.join(os.path.expanduser("~"), ".cache", "dbsql", "data_epoch")
+
+
+def epoch_file() -> str:
+    """the file holding the epoch, ``DBSQL_DATA_EPOCH_FILE`` overrides the default"""
+    return os.environ.get("DBSQL_DATA_EPOCH_FILE", DEFAULT_EPOCH_FILE)
+
+
+def current_data_epoch(path: Optional[str] = None) -> str:
+    """the current epoch, ``"0"`` until the first bump"""
+    try:
+        with open(path or epoch_file(), "r", encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def bump_data_epoch(path: Optional[str] = None) -> str:
+    """start a new epoch, call it after the data in the database has changed"""
+    path = path or epoch_file()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    epoch = str(time.time_ns())
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(epoch)
+    os.replace(tmp_path, path)
+    return epoch
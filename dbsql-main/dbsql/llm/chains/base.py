@@ -4,11 +4,10 @@ from dotenv import load_dotenv
 from abc import ABC, abstractmethod
 from urllib.parse import quote_plus as urlquote
 
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities import SQLDatabase
-
 from dbsql.dmdb.dm_database import DMDatabase
-from langchain_community.chat_models import ChatOllama
+from dbsql.llm.gateway import get_gateway
+from dbsql.mysqldb.mysql_database import MySQLDatabase
+from dbsql.result_cache import ResultCache
 load_dotenv()
 
 
@@ -20,21 +19,29 @@ class DBSQLAnswerBase(ABC):
                  db_port: int = 5236,
                  db_user: str = "XYCS",
                  db_password: str = "123456789",
-                 db_name: str = "XYCS"):
+                 db_name: str = "XYCS",
+                 query_timeout: float = 30.0,
+                 max_result_rows: int = 200):
         self.model = model
         self.llm = self.get_llm()
         self.db_type = db_type
+        self.query_timeout = query_timeout
+        self.max_result_rows = max_result_rows
+        # different phrasings often produce the same SQL, reuse its result until the data epoch changes
+        self.result_cache = ResultCache()
         self.db = self.get_db(db_host, db_port, db_user, db_password, db_name)
 
     def get_llm(self):
+        # every model goes through the shared gateway: pooled connections, concurrency limits, accounting
+        gateway = get_gateway()
         if 'qwen' in self.model:
-            llm = ChatOpenAI(model=self.model,
-                             openai_api_key=os.getenv("DASHSCOPE_API_KEY"),
-                             openai_api_base=os.getenv("DASHSCOPE_API_BASE"))
+            llm = gateway.chat_openai(model=self.model,
+                                      openai_api_key=os.getenv("DASHSCOPE_API_KEY"),
+                                      openai_api_base=os.getenv("DASHSCOPE_API_BASE"))
             return llm
         elif 'local' in self.model:
-            llm = ChatOllama(model="deepseek-r1:14b",
-                             base_url="https://u354342-baf8-f3ff1b79.bjc1.seetacloud.com:8443")
+            llm = gateway.chat_ollama(model="deepseek-r1:14b",
+                                      base_url="https://u354342-baf8-f3ff1b79.bjc1.seetacloud.com:8443")
             return llm
         else:
             raise NotImplementedError("Unsupported model. Supported models are: \n1). qwen* \n2). local")
@@ -46,13 +53,21 @@ class DBSQLAnswerBase(ABC):
                 port=port,
                 user=user,
                 password=password,
-                database=db_name
+                database=db_name,
+                statement_timeout=self.query_timeout,
+                max_result_rows=self.max_result_rows,
+                result_cache=self.result_cache,
             )
             return db
         elif self.db_type == "MySQL":
             password = urlquote(password)
             db_uri = f'mysql+pymysql://{user}:{password}@{host}:{port}/{db_name}'
-            return SQLDatabase.from_uri(db_uri)
+            return MySQLDatabase.from_uri(
+                db_uri,
+                statement_timeout=self.query_timeout,
+                max_result_rows=self.max_result_rows,
+                result_cache=self.result_cache,
+            )
         else:
             raise NotImplementedError("Unsupported DB Type")
 
@@ -1,8 +1,12 @@
+import asyncio
+import hashlib
 import json
 import os
 from operator import itemgetter
 import re
-from typing import Tuple
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from dotenv import load_dotenv
 from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
@@ -12,15 +16,27 @@ from langchain_core.runnables import RunnablePassthrough
 from loguru import logger
 
 from dbsql import logger
+from dbsql.budget import TokenBudget, prompt_logger
+from dbsql.cache import AnswerCache
+from dbsql.epoch import current_data_epoch
+from dbsql.memory import QueryMemory
+from dbsql.metrics import STAGE_SECONDS, record_cache, record_question
 from dbsql.llm.chains.base import DBSQLAnswerBase
-from dbsql.llm.chains.query import create_sql_query_chain_with_limit
+from dbsql.llm.chains.query import create_sql_query_chain_with_limit, create_table_selector
+from dbsql.profile import ProfileStore
+from dbsql.render import column_labels, render_answer
 from dbsql.llm.prompts.sql import (
     TABLE_QUERY,
     TABLE_PROMPT,
     QUESTION_PROMPT,
     ANSWER_PROMPT,
+    REPAIR_PROMPT,
 )
-from dbsql.utils import sql_extract
+from dbsql.result import QueryResult
+from dbsql.routing import TableRouter
+from dbsql.timeout import CancelToken, QueryTimeout
+from dbsql.utils import TableInfoFragments, sql_extract
+from dbsql.validation import SchemaValidator, validate_or_log
 
 load_dotenv()
 
@@ -35,26 +51,84 @@ class DBSQLAnswer(DBSQLAnswerBase):
         db_user: str = "DBSQL",
         db_password: str = "12345678",
         db_name: str = "DBTEST",
+        query_timeout: float = 30.0,
+        max_result_rows: int = 200,
+        answer_cache_size: int = 256,
+        answer_cache_dir: Optional[str] = None,
+        describe_workers: int = 4,
+        describe_retries: int = 2,
+        concurrent_candidates: bool = False,
+        candidate_deadline: float = 2.0,
+        max_repairs: int = 1,
+        repair_budget: float = 20.0,
+        render_answers: bool = True,
+        query_memory_threshold: float = 0.85,
+        schema_token_budget: int = 6000,
+        result_token_budget: int = 2000,
     ):
         super().__init__(
-            model, db_type, db_host, db_port, db_user, db_password, db_name
+            model, db_type, db_host, db_port, db_user, db_password, db_name,
+            query_timeout, max_result_rows,
         )
         self.table_info_path = "/home/jhl/Desktop/Course/NLP/data/table_info.json"
         self.table_info = None
+        self.column_labels: Dict[str, str] = dict()
+        self.describe_workers = describe_workers
+        self.describe_retries = describe_retries
+        # run all candidate queries at once and keep the earliest-listed success
+        self.concurrent_candidates = concurrent_candidates
+        self.candidate_deadline = candidate_deadline
+        # failed queries get at most `max_repairs` LLM fixes, started within `repair_budget` seconds
+        self.max_repairs = max_repairs
+        self.repair_budget = repair_budget
+        # simple results are formatted locally instead of by the answer LLM call
+        self.render_answers = render_answers
+        # bounds the schema and result context of every prompt
+        self.token_budget = TokenBudget(schema_tokens=schema_token_budget, result_tokens=result_token_budget)
         self.state_check()
 
+        # column statistics built offline by `python -m dbsql.profile`
+        self.profile_path = os.path.join(os.path.dirname(self.table_info_path), "table_profile.json")
+        self.profiles = ProfileStore(self.profile_path) if os.path.exists(self.profile_path) else None
+
+        # repeated questions are answered from the cache while model and schema are unchanged
+        self.answer_cache = AnswerCache(max_entries=answer_cache_size, path=answer_cache_dir)
+        # SQL that answered a question before: reused for near-duplicates, few-shot examples otherwise
+        self.query_memory = QueryMemory(
+            os.path.join(os.path.dirname(self.table_info_path), "query_memory.json"),
+            reuse_threshold=query_memory_threshold,
+        )
+
+        self.table_fragments = TableInfoFragments(self.db, self.table_info, self.profiles)
+        # picks tables without an LLM call, TABLE_PROMPT is the fallback when it is unsure
+        self.table_router = TableRouter(self.table_info)
         self.table_prompt = PromptTemplate.from_template(TABLE_PROMPT)
         self.sql_prompt = PromptTemplate.from_template(
-            QUESTION_PROMPT, partial_variables={"top_k": 10}
+            QUESTION_PROMPT, partial_variables={"top_k": 10, "examples": ""}
         )
         self.write_query = create_sql_query_chain_with_limit(
-            self.llm, self.db, self.table_prompt, self.sql_prompt, self.table_info
+            self.llm, self.db, self.table_prompt, self.sql_prompt, self.table_info,
+            profiles=self.profiles,
+            router=self.table_router,
+            fragments=self.table_fragments,
+            budget=self.token_budget,
+        )
+        self.select_tables = create_table_selector(
+            self.llm, self.table_prompt, self.table_fragments, self.table_router, self.token_budget
         )
 
         self.execute_query = QuerySQLDataBaseTool(db=self.db)
 
+        # rejects queries using unknown tables or columns before they reach the database
+        try:
+            self.validator = SchemaValidator.from_db(self.db)
+        except Exception as e:
+            logger.warning(f"SQL validation disabled: {str(e)}")
+            self.validator = None
+        self.repair = PromptTemplate.from_template(REPAIR_PROMPT) | prompt_logger("repair") | self.llm | StrOutputParser()
+
         self.answer_prompt = PromptTemplate.from_template(ANSWER_PROMPT)
-        self.answer = self.answer_prompt | self.llm | StrOutputParser()
+        self.answer = self.answer_prompt | prompt_logger("answer") | self.llm | StrOutputParser()
 
         self.chain = (  # Not used now
             RunnablePassthrough.assign(query=self.write_query).assign(
@@ -108,25 +182,670 @@ class DBSQLAnswer(DBSQLAnswerBase):
 
         if table_info is None:
             table_info = dict()
-            for table in self.db.get_usable_table_names():
-                table_info[table] = self.get_table_extra_info(table)
-        else:
-            for table in self.db.get_usable_table_names():
-                if table not in table_info.keys():
-                    table_info[table] = self.get_table_extra_info(table)
 
-        with open(self.table_info_path, "w", encoding='utf-8') as f:
-            json.dump(table_info, f)
+        # a table is described again only when its DDL fingerprint changed
+        tables = list(self.db.get_usable_table_names())
+        if hasattr(self.db, "preload_schema"):
+            self.db.preload_schema(tables)
+        fingerprints = {table: self._schema_hash(table) for table in tables}
+        missing = []
+        changed = False
+        for table, fingerprint in fingerprints.items():
+            entry = table_info.get(table)
+            if entry is None:
+                missing.append(table)
+            elif "schema_hash" not in entry:
+                # described before fingerprints were stored, adopt the current one
+                entry["schema_hash"] = fingerprint
+                changed = True
+            elif entry["schema_hash"] != fingerprint:
+                logger.info(f"schema of table {table} changed, describe it again")
+                missing.append(table)
+
+        if missing:
+            self._describe_tables(table_info, missing, fingerprints)
+        elif changed:
+            self._save_table_info(table_info)
         self.table_info = table_info
+        # rendered answers name columns by their descriptions, not their identifiers
+        self.column_labels = column_labels(table_info)
+        schema = json.dumps(table_info, sort_keys=True, ensure_ascii=False)
+        self.schema_version = hashlib.sha1(schema.encode("utf-8")).hexdigest()[:12]
+
+    def _schema_hash(self, table: str) -> str:
+        ddl = self.db.get_table_ddl(table)
+        return hashlib.sha1(ddl.encode("utf-8")).hexdigest()[:16]
+
+    def _describe_tables(self, table_info: Dict[str, Dict], tables: List[str], fingerprints: Dict[str, str]) -> None:
+        """describe ``tables`` with bounded concurrency, saving after every table so
+        that a crash or a failed table never loses the descriptions already made"""
+        failed = []
+
+        def describe(table: str) -> Dict:
+            for attempt in range(1, self.describe_retries + 2):
+                try:
+                    return self.get_table_extra_info(table)
+                except Exception as e:
+                    logger.warning(f"describe table {table} failed (attempt {attempt}): {str(e)}")
+                    if attempt > self.describe_retries:
+                        raise
+                    time.sleep(2 ** attempt)
+
+        with ThreadPoolExecutor(max_workers=self.describe_workers) as executor:
+            futures = {executor.submit(describe, table): table for table in tables}
+            for done, future in enumerate(as_completed(futures), 1):
+                table = futures[future]
+                try:
+                    info = future.result()
+                except Exception:
+                    failed.append(table)
+                    continue
+                info["schema_hash"] = fingerprints[table]
+                table_info[table] = info
+                self._save_table_info(table_info)
+                logger.info(f"described table {table} ({done}/{len(tables)})")
+
+        if failed:
+            raise RuntimeError(f"cannot describe tables {failed}, rerun to retry only these tables")
+
+    def _save_table_info(self, table_info: Dict[str, Dict]) -> None:
+        tmp_path = f"{self.table_info_path}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump(table_info, f)
+        os.replace(tmp_path, self.table_info_path)
+
+    def cache_version(self) -> str:
+        """version of the schema descriptions and of the data answers depend on"""
+        return f"{self.db_type}:{self.schema_version}:{current_data_epoch()}"
+
+    def refresh_schema(self, tables: Optional[List[str]] = None) -> None:
+        """rebuild the prompt fragments of ``tables`` (all when None) after their schema changed"""
+        if hasattr(self.db, "invalidate_schema_cache"):
+            self.db.invalidate_schema_cache(tables)
+        self.table_fragments.refresh(tables)
+
+    def invalidate_answer_cache(self) -> None:
+        """forget every cached answer and SQL result, call it after importing new data"""
+        self.answer_cache.invalidate()
+        self.result_cache.invalidate()
 
     def step_run(self, question: str, splitter_len=60) -> Tuple[str, str]:
+        start = time.perf_counter()
+        try:
+            process, answer = self._step_run(question, splitter_len)
+        except Exception:
+            record_question("failure", time.perf_counter() - start)
+            raise
+        record_question(self._outcome(process, answer), time.perf_counter() - start)
+        return process, answer
+
+    def _step_run(self, question: str, splitter_len=60) -> Tuple[str, str]:
+        cache_key = self.answer_cache.key(question, self.model, self.cache_version())
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"answer cache hit: {question}")
+            return cached
+
         response = ["llm response".center(splitter_len, "-")]
-        # table_choice = self.table_prompt.invoke({})
+        successful_query, result = self._reuse(question, response, splitter_len)
+        if not successful_query:
+            # table_choice = self.table_prompt.invoke({})
+
+            # response.append("llm response".center(splitter_len, "-"))
+            sql_query_raw = self.write_query.invoke(
+                {"question": question, "examples": self.query_memory.examples(question)}
+            )  # question input
+            sql_queries = self._extract_queries(sql_query_raw, response, splitter_len)
+            if not sql_queries:
+                return self._unknown(response, splitter_len)
+
+            successful_query, result = self._resolve(question, sql_queries, response)
+
+        if not successful_query:
+            return self._all_failed(response, splitter_len)
+        self._remember(question, successful_query, result)
+
+        inputs = self._answer_inputs(question, successful_query, result, response, splitter_len)
+        final_answer = self._rendered_answer(question, result)
+        if final_answer is None:
+            with STAGE_SECONDS.time(stage="answer"):
+                final_answer = self.answer.invoke(inputs)
+        response.append(final_answer)
+        self.answer_cache.set(cache_key, ("\n".join(response), final_answer))
+        return "\n".join(response), final_answer
+
+    def step_run_batch(
+            self, questions: List[str], max_concurrency: int = 4, splitter_len=60
+    ) -> List[Union[Tuple[str, str], Exception]]:
+        """``step_run`` for many questions. Each stage (tables, SQL, execution, answer)
+        runs for all questions at once through ``.batch()`` with at most
+        ``max_concurrency`` calls in flight, sharing the prebuilt table fragments.
+
+        Returns ``(process, answer)`` per question in input order, or the exception
+        that stopped that question.
+        """
+        start = time.perf_counter()
+        config = {"max_concurrency": max_concurrency}
+        results: List[Any] = [None] * len(questions)
+
+        def finish(i: int, result: Any) -> None:
+            # a question's latency runs from the start of the batch to its own result
+            results[i] = result
+            outcome = "failure" if isinstance(result, Exception) else self._outcome(*result)
+            record_question(outcome, time.perf_counter() - start)
+
+        version = self.cache_version()
+        keys = [self.answer_cache.key(question, self.model, version) for question in questions]
+        pending = []
+        for i, key in enumerate(keys):
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                finish(i, cached)
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+        logger.info(f"answer {len(pending)} of {len(questions)} questions in a batch")
+
+        def succeeded(indices: List[int], outputs: List[Any]) -> List[Tuple[int, Any]]:
+            kept = []
+            for i, output in zip(indices, outputs):
+                if isinstance(output, Exception):
+                    logger.error(f"question {i + 1} failed: {str(output)}")
+                    finish(i, output)
+                else:
+                    kept.append((i, output))
+            return kept
+
+        tables = succeeded(pending, self.select_tables.batch(
+            [{"question": questions[i]} for i in pending], config, return_exceptions=True
+        ))
+        raw_queries = succeeded([i for i, _ in tables], self.write_query.batch(
+            [
+                {"question": questions[i], "relevant_table_names": names, "examples": self.query_memory.examples(questions[i])}
+                for i, names in tables
+            ],
+            config, return_exceptions=True,
+        ))
+
+        responses = dict()
+        executable = []
+        for i, sql_query_raw in raw_queries:
+            responses[i] = ["llm response".center(splitter_len, "-")]
+            sql_queries = self._extract_queries(sql_query_raw, responses[i], splitter_len)
+            if sql_queries:
+                executable.append((i, sql_queries))
+            else:
+                finish(i, self._unknown(responses[i], splitter_len))
+
+        # queries run on pooled connections, at most max_concurrency at a time
+        outputs = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = [executor.submit(self._resolve, questions[i], q, responses[i]) for i, q in executable]
+            for future in futures:
+                try:
+                    outputs.append(future.result())
+                except Exception as e:
+                    outputs.append(e)
 
-        # response.append("llm response".center(splitter_len, "-"))
-        sql_query_raw = self.write_query.invoke(
-            {"question": question}
-        )  # question input
+        answers = []
+        prompts = []
+        for i, (successful_query, result) in succeeded([i for i, _ in executable], outputs):
+            if not successful_query:
+                finish(i, self._all_failed(responses[i], splitter_len))
+                continue
+            self._remember(questions[i], successful_query, result)
+            inputs = self._answer_inputs(questions[i], successful_query, result, responses[i], splitter_len)
+            rendered = self._rendered_answer(questions[i], result)
+            if rendered is None:
+                prompts.append((i, inputs))
+            else:
+                answers.append((i, rendered))
+        if prompts:
+            answer_start = time.perf_counter()
+            outputs = self.answer.batch([inputs for _, inputs in prompts], config, return_exceptions=True)
+            # the prompts are answered together, each of them waited for the whole batch
+            answer_seconds = time.perf_counter() - answer_start
+            for _ in prompts:
+                STAGE_SECONDS.observe(answer_seconds, stage="answer")
+            answers.extend(succeeded([i for i, _ in prompts], outputs))
+
+        for i, final_answer in answers:
+            responses[i].append(final_answer)
+            finish(i, ("\n".join(responses[i]), final_answer))
+            self.answer_cache.set(keys[i], results[i])
+        return results
+
+    async def astep_run(self, question: str, splitter_len=60) -> Tuple[str, str]:
+        """``step_run`` as a coroutine: SQL runs on the database's executor and the
+        LLM calls are awaited, so many questions can be answered concurrently"""
+        start = time.perf_counter()
+        try:
+            process, answer = await self._astep_run(question, splitter_len)
+        except Exception:
+            record_question("failure", time.perf_counter() - start)
+            raise
+        record_question(self._outcome(process, answer), time.perf_counter() - start)
+        return process, answer
+
+    async def _astep_run(self, question: str, splitter_len=60) -> Tuple[str, str]:
+        cache_key = self.answer_cache.key(question, self.model, self.cache_version())
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"answer cache hit: {question}")
+            return cached
+
+        response = ["llm response".center(splitter_len, "-")]
+        successful_query, result = await self._areuse(question, response, splitter_len)
+        if not successful_query:
+            sql_query_raw = await self.write_query.ainvoke(
+                {"question": question, "examples": self.query_memory.examples(question)}
+            )
+            sql_queries = self._extract_queries(sql_query_raw, response, splitter_len)
+            if not sql_queries:
+                return self._unknown(response, splitter_len)
+
+            successful_query, result = await self._aresolve(question, sql_queries, response)
+
+        if not successful_query:
+            return self._all_failed(response, splitter_len)
+        self._remember(question, successful_query, result)
+
+        inputs = self._answer_inputs(question, successful_query, result, response, splitter_len)
+        final_answer = self._rendered_answer(question, result)
+        if final_answer is None:
+            with STAGE_SECONDS.time(stage="answer"):
+                final_answer = await self.answer.ainvoke(inputs)
+        response.append(final_answer)
+        self.answer_cache.set(cache_key, ("\n".join(response), final_answer))
+        return "\n".join(response), final_answer
+
+    async def astep_stream(self, question: str, splitter_len=60) -> AsyncIterator[Dict[str, Any]]:
+        """``astep_run`` yielding each stage as soon as it completes:
+
+        - ``{"stage": "tables", "data": [table, ...]}``
+        - ``{"stage": "sql", "data": [query, ...]}``
+        - ``{"stage": "result", "data": {"query": str, "result": str, "truncated": bool}}``
+        - ``{"stage": "token", "data": str}`` for every chunk of the streamed answer
+        - ``{"stage": "done", "data": {"answer": str, "process": str}}``
+
+        A failed stage ends the stream with ``done`` carrying "I do not know".
+        """
+        start = time.perf_counter()
+        try:
+            async for stage in self._astep_stream(question, splitter_len):
+                if stage["stage"] == "done":
+                    outcome = self._outcome(stage["data"]["process"], stage["data"]["answer"])
+                    record_question(outcome, time.perf_counter() - start)
+                yield stage
+        except Exception:
+            record_question("failure", time.perf_counter() - start)
+            raise
+
+    async def _astep_stream(self, question: str, splitter_len=60) -> AsyncIterator[Dict[str, Any]]:
+        cache_key = self.answer_cache.key(question, self.model, self.cache_version())
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"answer cache hit: {question}")
+            yield {"stage": "done", "data": {"answer": cached[1], "process": cached[0], "cached": True}}
+            return
+
+        response = ["llm response".center(splitter_len, "-")]
+        successful_query, result = await self._areuse(question, response, splitter_len)
+        if successful_query:
+            tables = self.validator.referenced_tables(successful_query) if self.validator is not None else []
+            yield {"stage": "tables", "data": tables}
+            yield {"stage": "sql", "data": [successful_query]}
+        else:
+            tables = await self.select_tables.ainvoke({"question": question})
+            yield {"stage": "tables", "data": tables}
+
+            sql_query_raw = await self.write_query.ainvoke({
+                "question": question,
+                "relevant_table_names": tables,
+                "examples": self.query_memory.examples(question),
+            })
+            sql_queries = self._extract_queries(sql_query_raw, response, splitter_len)
+            yield {"stage": "sql", "data": sql_queries}
+            if not sql_queries:
+                process, answer = self._unknown(response, splitter_len)
+                yield {"stage": "done", "data": {"answer": answer, "process": process}}
+                return
+
+            successful_query, result = await self._aresolve(question, sql_queries, response)
+
+        if not successful_query:
+            process, answer = self._all_failed(response, splitter_len)
+            yield {"stage": "done", "data": {"answer": answer, "process": process}}
+            return
+        self._remember(question, successful_query, result)
+
+        inputs = self._answer_inputs(question, successful_query, result, response, splitter_len)
+        yield {
+            "stage": "result",
+            "data": {"query": successful_query, "result": inputs["sql_result"], "truncated": result.truncated},
+        }
+
+        final_answer = self._rendered_answer(question, result)
+        if final_answer is not None:
+            yield {"stage": "token", "data": final_answer}
+        else:
+            chunks = []
+            answer_start = time.perf_counter()
+            async for chunk in self.answer.astream(inputs):
+                chunks.append(chunk)
+                yield {"stage": "token", "data": chunk}
+            STAGE_SECONDS.observe(time.perf_counter() - answer_start, stage="answer")
+            final_answer = "".join(chunks)
+        response.append(final_answer)
+        self.answer_cache.set(cache_key, ("\n".join(response), final_answer))
+        yield {"stage": "done", "data": {"answer": final_answer, "process": "\n".join(response)}}
+
+    def _resolve(
+            self, question: str, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult]]:
+        """validate and execute the candidates; when none succeeds, ask the LLM to fix the
+        first failure (validation or database error) at most ``max_repairs`` times"""
+        deadline = time.perf_counter() + self.repair_budget
+        candidates, failures = self._validate(sql_queries, response)
+        executed = False
+        for attempt in range(self.max_repairs + 1):
+            if candidates:
+                successful_query, result, errors = self._execute_candidates(candidates, response)
+                executed = True
+                if successful_query:
+                    return successful_query, result
+                failures = errors
+            if not self._can_repair(attempt, deadline, failures):
+                break
+            with STAGE_SECONDS.time(stage="repair"):
+                repaired = self.repair.invoke(self._repair_inputs(question, failures[0]))
+            candidates, failures = self._validate(self._repaired_queries(repaired, attempt, response), response)
+
+        if not executed:
+            # the validator may be wrong, let the database have the final word
+            successful_query, result, _ = self._execute_candidates(sql_queries, response)
+            return successful_query, result
+        return None, None
+
+    async def _aresolve(
+            self, question: str, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult]]:
+        """``_resolve`` with awaited queries and repair calls"""
+        deadline = time.perf_counter() + self.repair_budget
+        candidates, failures = self._validate(sql_queries, response)
+        executed = False
+        for attempt in range(self.max_repairs + 1):
+            if candidates:
+                successful_query, result, errors = await self._aexecute_candidates(candidates, response)
+                executed = True
+                if successful_query:
+                    return successful_query, result
+                failures = errors
+            if not self._can_repair(attempt, deadline, failures):
+                break
+            with STAGE_SECONDS.time(stage="repair"):
+                repaired = await self.repair.ainvoke(self._repair_inputs(question, failures[0]))
+            candidates, failures = self._validate(self._repaired_queries(repaired, attempt, response), response)
+
+        if not executed:
+            successful_query, result, _ = await self._aexecute_candidates(sql_queries, response)
+            return successful_query, result
+        return None, None
+
+    def _recalled_query(self, question: str) -> Optional[Dict]:
+        """the remembered pair whose SQL can answer ``question`` unchanged"""
+        entry = self.query_memory.match(question)
+        if entry is not None:
+            errors = validate_or_log(self.validator, entry["sql"])
+            if errors:
+                logger.warning(f"remembered query no longer valid: {'; '.join(errors)}")
+                self.query_memory.forget(entry["question"])
+                entry = None
+        record_cache("query_memory", hit=entry is not None)
+        return entry
+
+    def _reused(self, entry: Dict, response: List[str], splitter_len: int) -> None:
+        response.append(f"reuse query of similar question: {entry['question']}")
+        response.append(f"query 1: \n{entry['sql']}")
+        response.append("execution result".center(splitter_len, "-"))
+
+    def _reuse(
+            self, question: str, response: List[str], splitter_len: int
+    ) -> Tuple[Optional[str], Optional[QueryResult]]:
+        """run the remembered SQL of a near-duplicate question, skipping table
+        selection and SQL generation"""
+        entry = self._recalled_query(question)
+        if entry is None:
+            return None, None
+        try:
+            with STAGE_SECONDS.time(stage="execution"):
+                result = self.db.query(entry["sql"])
+        except Exception as e:
+            logger.warning(f"remembered query failed, generate a new one: {str(e)}")
+            self.query_memory.forget(entry["question"])
+            return None, None
+        self._reused(entry, response, splitter_len)
+        return entry["sql"], result
+
+    async def _areuse(
+            self, question: str, response: List[str], splitter_len: int
+    ) -> Tuple[Optional[str], Optional[QueryResult]]:
+        entry = self._recalled_query(question)
+        if entry is None:
+            return None, None
+        try:
+            with STAGE_SECONDS.time(stage="execution"):
+                result = await self.db.aquery(entry["sql"])
+        except Exception as e:
+            logger.warning(f"remembered query failed, generate a new one: {str(e)}")
+            self.query_memory.forget(entry["question"])
+            return None, None
+        self._reused(entry, response, splitter_len)
+        return entry["sql"], result
+
+    def _remember(self, question: str, sql_query: str, result: QueryResult) -> None:
+        # an empty result may just as well come from a wrong query, keep only answers with data
+        if result.row_count > 0:
+            self.query_memory.add(question, sql_query)
+
+    def _execute_candidates(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        if self.concurrent_candidates and len(sql_queries) > 1:
+            return self._execute_concurrently(sql_queries, response)
+        return self._execute_in_order(sql_queries, response)
+
+    async def _aexecute_candidates(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        if self.concurrent_candidates and len(sql_queries) > 1:
+            return await self._aexecute_concurrently(sql_queries, response)
+        return await self._aexecute_in_order(sql_queries, response)
+
+    def _validate(self, sql_queries: List[str], response: List[str]) -> Tuple[List[str], List[Tuple[str, str]]]:
+        """split ``sql_queries`` into the valid ones and ``(query, errors)`` of the rejected ones"""
+        valid, rejected = [], []
+        for i, sql_query in enumerate(sql_queries):
+            errors = validate_or_log(self.validator, sql_query)
+            if errors:
+                message = "; ".join(errors)
+                logger.warning(f"query {i + 1} rejected: {message}")
+                response.append(f"query {i + 1} rejected: {message}")
+                rejected.append((sql_query, message))
+            else:
+                valid.append(sql_query)
+        return valid, rejected
+
+    def _can_repair(self, attempt: int, deadline: float, failures: List[Tuple[str, str]]) -> bool:
+        if not failures or attempt >= self.max_repairs:
+            return False
+        if time.perf_counter() > deadline:
+            logger.warning("repair budget exhausted, skip SQL repair")
+            return False
+        return True
+
+    def _repair_inputs(self, question: str, failure: Tuple[str, str]) -> Dict[str, str]:
+        sql_query, errors = failure
+        tables = self.validator.referenced_tables(sql_query) if self.validator is not None else []
+        if not tables:
+            tables = self.table_router.route(question)
+        logger.info(f"repair query: {sql_query}\nerrors: {errors}")
+        return {
+            "question": question,
+            "sql_query": sql_query,
+            "errors": errors,
+            "table_info": self.token_budget.fit_schema(question, self.table_fragments.pieces(tables), "repair schema"),
+        }
+
+    @staticmethod
+    def _repaired_queries(repaired_raw: str, attempt: int, response: List[str]) -> List[str]:
+        sql_queries = sql_extract(repaired_raw)
+        response.append(f"repair {attempt + 1}:")
+        response.extend(sql_queries if sql_queries else ["None"])
+        return sql_queries
+
+    def _execute_in_order(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        failures = []
+        for i, sql_query in enumerate(sql_queries):
+            try:
+                logger.info(f"try to execute query {i + 1}: {sql_query}")
+                with STAGE_SECONDS.time(stage="execution"):
+                    return sql_query, self.db.query(sql_query), failures
+            except Exception as e:
+                self._query_failed(i, e, response)
+                failures.append((sql_query, str(e)))
+        return None, None, failures
+
+    async def _aexecute_in_order(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        failures = []
+        for i, sql_query in enumerate(sql_queries):
+            try:
+                logger.info(f"try to execute query {i + 1}: {sql_query}")
+                with STAGE_SECONDS.time(stage="execution"):
+                    return sql_query, await self.db.aquery(sql_query), failures
+            except Exception as e:
+                self._query_failed(i, e, response)
+                failures.append((sql_query, str(e)))
+        return None, None, failures
+
+    def _timed_query(self, sql_query: str, token: CancelToken) -> Tuple[Optional[QueryResult], Optional[Exception], float]:
+        start = time.perf_counter()
+        try:
+            with STAGE_SECONDS.time(stage="execution"):
+                return self.db.query(sql_query, cancel_token=token), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    async def _atimed_query(
+            self, sql_query: str, token: CancelToken
+    ) -> Tuple[Optional[QueryResult], Optional[Exception], float]:
+        start = time.perf_counter()
+        try:
+            with STAGE_SECONDS.time(stage="execution"):
+                return await self.db.aquery(sql_query, cancel_token=token), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    @staticmethod
+    def _preferred_success(outcomes: Dict[int, Tuple], count: int, final: bool) -> Optional[int]:
+        """the earliest-listed successful candidate, once every earlier one has failed
+        (or unconditionally when ``final``)"""
+        for i in range(count):
+            if i not in outcomes:
+                if not final:
+                    return None
+                continue
+            if outcomes[i][1] is None:
+                return i
+        return None
+
+    def _choose_candidate(
+            self, sql_queries: List[str], outcomes: Dict[int, Tuple], tokens: List[CancelToken], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        chosen = self._preferred_success(outcomes, len(sql_queries), final=True)
+        for i, token in enumerate(tokens):
+            if i != chosen and i not in outcomes:
+                token.cancel()
+
+        failures = []
+        for i in range(len(sql_queries)):
+            if i not in outcomes:
+                response.append(f"query {i + 1} cancelled")
+                continue
+            result, error, elapsed = outcomes[i]
+            if error is not None:
+                self._query_failed(i, error, response)
+                response[-1] += f" ({elapsed:.2f}s)"
+                failures.append((sql_queries[i], str(error)))
+            else:
+                status = "chosen" if i == chosen else "not used"
+                response.append(f"query {i + 1} succeeded ({elapsed:.2f}s, {status})")
+        if chosen is None:
+            return None, None, failures
+        return sql_queries[chosen], outcomes[chosen][0], failures
+
+    def _execute_concurrently(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        """run every candidate at once on pooled connections. The earliest-listed
+        success is taken as soon as all candidates before it failed; after the first
+        success the others get ``candidate_deadline`` seconds, then the rest are cancelled"""
+        logger.info(f"execute {len(sql_queries)} candidate queries concurrently")
+        tokens = [CancelToken() for _ in sql_queries]
+        outcomes = dict()
+        executor = ThreadPoolExecutor(max_workers=len(sql_queries))
+        futures = {executor.submit(self._timed_query, q, tokens[i]): i for i, q in enumerate(sql_queries)}
+        pending = set(futures)
+        deadline = None
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    outcomes[futures[future]] = future.result()
+                if self._preferred_success(outcomes, len(sql_queries), final=False) is not None:
+                    break
+                if deadline is None and any(outcome[1] is None for outcome in outcomes.values()):
+                    deadline = time.perf_counter() + self.candidate_deadline
+            return self._choose_candidate(sql_queries, outcomes, tokens, response)
+        finally:
+            executor.shutdown(wait=False)
+
+    async def _aexecute_concurrently(
+            self, sql_queries: List[str], response: List[str]
+    ) -> Tuple[Optional[str], Optional[QueryResult], List[Tuple[str, str]]]:
+        """``_execute_concurrently`` on the database's async executor"""
+        logger.info(f"execute {len(sql_queries)} candidate queries concurrently")
+        tokens = [CancelToken() for _ in sql_queries]
+        outcomes = dict()
+        tasks = {
+            asyncio.ensure_future(self._atimed_query(q, tokens[i])): i for i, q in enumerate(sql_queries)
+        }
+        pending = set(tasks)
+        deadline = None
+        loop = asyncio.get_running_loop()
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                outcomes[tasks[task]] = task.result()
+            if self._preferred_success(outcomes, len(sql_queries), final=False) is not None:
+                break
+            if deadline is None and any(outcome[1] is None for outcome in outcomes.values()):
+                deadline = loop.time() + self.candidate_deadline
+        return self._choose_candidate(sql_queries, outcomes, tokens, response)
+
+    @staticmethod
+    def _extract_queries(sql_query_raw: str, response: List[str], splitter_len: int) -> List[str]:
         logger.info(f"llm response\n{str(sql_query_raw)}")
         response.append(sql_query_raw)
 
@@ -137,59 +856,67 @@ class DBSQLAnswer(DBSQLAnswerBase):
 
             response.append("execution result".center(splitter_len, "-"))
             response.append("None")
+            return sql_queries
 
-            response.append("final response".center(splitter_len, "-"))
-            response.append("I do not know")
-            return "\n".join(response), "I do not know"
-
-        else:
-            sql_queries_str = "\n".join(sql_queries)
-            logger.info(f"extract valid SQL queries: \n{sql_queries_str}")
-            response.extend(
-                [f"query {i + 1}: \n{query}" for i, query in enumerate(sql_queries)]
-            )
-
-            response.append("execution result".center(splitter_len, "-"))
-
-            successful_query = None
-            execution_result = None
-
-            for i, sql_query in enumerate(sql_queries):
-                try:
-                    logger.info(f"try to execute query {i + 1}: {sql_query}")
-                    result = self.execute_query.invoke({"query": sql_query})
-                    if result.startswith("Error"):
-                        raise RuntimeError(result)
-
-                    successful_query = sql_query
-                    execution_result = result
-                    break
-                except Exception as e:
-                    logger.error(f"query {i + 1} execute failed: {str(e)}")
-                    response.append(f"query {i + 1} execute failed")
+        sql_queries_str = "\n".join(sql_queries)
+        logger.info(f"extract valid SQL queries: \n{sql_queries_str}")
+        response.extend(
+            [f"query {i + 1}: \n{query}" for i, query in enumerate(sql_queries)]
+        )
 
-            if not successful_query:
-                logger.error("all queries execute failed!")
-                response.append("all queries execute failed")
-
-                response.append("final response".center(splitter_len, "-"))
-                response.append("I do not know")
-                return "\n".join(response), "I do not know"
-
-            response.append(f"successful query: \n{successful_query}")
-            response.append(f"successful execution: \n{execution_result}")
-
-            response.append("final response".center(splitter_len, "-"))
-            final_answer = self.answer.invoke(
-                {
-                    "user_question": question,
-                    "sql_query": successful_query,
-                    "sql_result": execution_result,
-                }
-            )
-            response.append(final_answer)
-            return "\n".join(response), final_answer
+        response.append("execution result".center(splitter_len, "-"))
+        return sql_queries
 
+    def _query_failed(self, i: int, error: Exception, response: List[str]) -> None:
+        if isinstance(error, QueryTimeout):
+            logger.error(f"query {i + 1} timed out: {str(error)}")
+            response.append(f"query {i + 1} timed out after {self.query_timeout}s")
+        else:
+            logger.error(f"query {i + 1} execute failed: {str(error)}")
+            response.append(f"query {i + 1} execute failed")
+
+    def _all_failed(self, response: List[str], splitter_len: int) -> Tuple[str, str]:
+        logger.error("all queries execute failed!")
+        response.append("all queries execute failed")
+        return self._unknown(response, splitter_len)
+
+    @staticmethod
+    def _outcome(process: str, answer: str) -> str:
+        if answer != "I do not know":
+            return "success"
+        return "failure" if "all queries execute failed" in process else "unknown"
+
+    @staticmethod
+    def _unknown(response: List[str], splitter_len: int) -> Tuple[str, str]:
+        response.append("final response".center(splitter_len, "-"))
+        response.append("I do not know")
+        return "\n".join(response), "I do not know"
+
+    def _rendered_answer(self, question: str, result: QueryResult) -> Optional[str]:
+        if not self.render_answers:
+            return None
+        answer = render_answer(question, result, self.column_labels)
+        if answer is not None:
+            logger.info("answer rendered from the result, skip the answer LLM call")
+        return answer
+
+    def _answer_inputs(
+            self, question: str, successful_query: str, result: QueryResult, response: List[str], splitter_len: int
+    ) -> Dict[str, str]:
+        execution_result = self.token_budget.fit_result(result)
+        response.append(f"successful query: \n{successful_query}")
+        response.append(f"successful execution: \n{execution_result}")
+        if result.metadata.get("row_limit_hit"):
+            response.append(f"row limit reached: only the first {result.row_count} rows were returned")
+        elif result.metadata.get("byte_limit_hit"):
+            response.append(f"size limit reached: only the first {result.row_count} rows were returned")
+
+        response.append("final response".center(splitter_len, "-"))
+        return {
+            "user_question": question,
+            "sql_query": successful_query,
+            "sql_result": execution_result,
+        }
 
 if __name__ == "__main__":
     dbsql_answer = DBSQLAnswer(model="glm4")
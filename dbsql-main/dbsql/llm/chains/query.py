@@ -1,24 +1,86 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Dict, Optional, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 from langchain.chains.sql_database.query import create_sql_query_chain, SQLInput, SQLInputWithTables
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import BasePromptTemplate
-from langchain_core.runnables import Runnable, RunnablePassthrough
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda, RunnablePassthrough
 
 if TYPE_CHECKING:
     from langchain_community.utilities.sql_database import SQLDatabase
 
+from dbsql.budget import TokenBudget, log_tokens, prompt_logger
+from dbsql.metrics import STAGE_SECONDS, TABLE_ROUTING
+from dbsql.profile import ProfileStore
+from dbsql.routing import TableRouter
 from dbsql.utils import table_extract
-from dbsql.utils import table_info_generate
+from dbsql.utils import TableInfoFragments
 
 
 def _strip(text: str) -> str:
     return text.strip()
 
 
+def timed(stage: str, runnable: Runnable) -> Runnable:
+    """``runnable`` observed in the ``stage`` latency histogram"""
+    def _invoke(x: Any, config: RunnableConfig) -> Any:
+        with STAGE_SECONDS.time(stage=stage):
+            return runnable.invoke(x, config)
+
+    async def _ainvoke(x: Any, config: RunnableConfig) -> Any:
+        with STAGE_SECONDS.time(stage=stage):
+            return await runnable.ainvoke(x, config)
+
+    return RunnableLambda(_invoke, afunc=_ainvoke)
+
+
+def _table_info(
+        fragments: TableInfoFragments,
+        budget: Optional[TokenBudget],
+        question: str,
+        table_names: Optional[List[str]],
+        stage: str,
+) -> str:
+    if budget is None:
+        return fragments.render(table_names)
+    return budget.fit_schema(question, fragments.pieces(table_names), stage)
+
+
+def create_table_selector(
+        llm: BaseLanguageModel,
+        table_prompt: BasePromptTemplate,
+        fragments: TableInfoFragments,
+        router: Optional[TableRouter] = None,
+        budget: Optional[TokenBudget] = None,
+) -> Runnable[Dict[str, Any], Optional[List[str]]]:
+    """runnable mapping ``{"question": str}`` to the relevant table names"""
+    def _relevant_table_names(x: Dict[str, Any]) -> Optional[List[str]]:
+        with STAGE_SECONDS.time(stage="routing"):
+            return _select(x)
+
+    def _select(x: Dict[str, Any]) -> Optional[List[str]]:
+        question = x["question"]
+        if router is not None:
+            tables = router.route(question)
+            if tables:
+                TABLE_ROUTING.inc(method="router")
+                return tables
+
+        # the LLM picks the tables when the lexical router is not confident
+        table_info = _table_info(fragments, budget, question, x.get("table_names_to_use"), "tables schema")
+        prompt = table_prompt.invoke({
+            "question": question,
+            "table_info": table_info,
+        })
+        log_tokens("tables", prompt.to_string())
+        TABLE_ROUTING.inc(method="llm")
+        return table_extract(llm.invoke(prompt))
+
+    return RunnableLambda(_relevant_table_names)
+
+
 def create_sql_query_chain_with_limit(
         llm: BaseLanguageModel,
         db: SQLDatabase,
@@ -26,18 +88,22 @@ def create_sql_query_chain_with_limit(
         query_prompt: Optional[BasePromptTemplate] = None,
         extra_data: Dict = None,
         k: int = 5,
+        profiles: Optional[ProfileStore] = None,
+        router: Optional[TableRouter] = None,
+        fragments: Optional[TableInfoFragments] = None,
+        budget: Optional[TokenBudget] = None,
 ) -> Runnable[Union[SQLInput, SQLInputWithTables, Dict[str, Any]], str]:
     if table_prompt is None:
         return create_sql_query_chain(llm, db, query_prompt, k)
 
     # TODO: replace get_table_info with get_table_description
+    if fragments is None:
+        # the schema text of every table is built once, not per question
+        fragments = TableInfoFragments(db, extra_data, profiles)
+    select_tables = create_table_selector(llm, table_prompt, fragments, router, budget)
+
     inputs = {
         "input": lambda x: x["question"] + "\nSQLQuery: ",
-        "table_info": lambda x: table_info_generate(
-            db=db,
-            table_names=x.get("table_names_to_use", ""),
-            extra_data=extra_data,
-        ),
     }
 
     return (
@@ -45,23 +111,17 @@ def create_sql_query_chain_with_limit(
             | (
                 lambda x: {
                     **x,
-                    "relevant_table_names": table_extract(
-                        llm.invoke(
-                            table_prompt.invoke({
-                                "question": x["input"].replace("\nSQLQuery: ", ""),
-                                "table_info": x["table_info"],
-                            })
-                        )
-                    )
+                    # callers that already chose the tables (e.g. to report them) pass them in
+                    "relevant_table_names": (
+                        x["relevant_table_names"] if "relevant_table_names" in x else select_tables.invoke(x)
+                    ),
                 }
             )
             | (
                 lambda x: {
                     **x,
-                    "table_info": table_info_generate(
-                        db=db,
-                        table_names=x["relevant_table_names"],
-                        extra_data=extra_data,
+                    "table_info": _table_info(
+                        fragments, budget, x["question"], x["relevant_table_names"], "sql schema"
                     ),
                 }
             )
@@ -72,8 +132,12 @@ def create_sql_query_chain_with_limit(
                     if k not in ("question", "table_names_to_use", "relevant_table_names")
                 }
             )
-            | query_prompt.partial(top_k=str(k))
-            | llm.bind(stop=["\nSQLResult:"])
-            | StrOutputParser()
-            | _strip
+            | timed(
+                "sql_generation",
+                query_prompt.partial(top_k=str(k))
+                | prompt_logger("sql")
+                | llm.bind(stop=["\nSQLResult:"])
+                | StrOutputParser()
+                | _strip
+            )
     )
@@ -1,56 +1,73 @@
+import asyncio
 import os
+from functools import lru_cache
 from operator import itemgetter
-from typing import List, Union, Tuple
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Union, Tuple
 
 from dotenv import load_dotenv
 from langchain.chains import create_sql_query_chain
 from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable, RunnablePassthrough
 from loguru import logger
 
 from dbsql import logger
-from dbsql.dmdb import DMdb
+from dbsql.llm.gateway import get_gateway
 from dbsql.llm.prompts.sql import QUESTION_PROMPT, ANSWER_PROMPT
 from dbsql.utils import sql_extract
 
 load_dotenv()
 
-# TODO: 开放 LLM 配置参数
-llm = ChatOpenAI(model="qwen-coder-plus",
-                 openai_api_key=os.getenv("DASHSCOPE_API_KEY"),
-                 openai_api_base=os.getenv("DASHSCOPE_API_BASE"))
 
-# llm = ChatOpenAI(model=os.getenv("MODEL_NAME"),
-#                  openai_api_key=os.getenv("API_KEY"),
-#                  openai_api_base=os.getenv("API_BASE"))
+class SQLChains(NamedTuple):
+    write_query: Runnable
+    execute_query: QuerySQLDataBaseTool
+    answer: Runnable
+    chain: Runnable
+    db: Any
 
-# Notice: you can add prompt here. And the prompt should be added here.
-question_prompt = PromptTemplate.from_template(QUESTION_PROMPT, partial_variables={'top_k': 10})
-logger.info(f"question_prompt\n{str(question_prompt)}")
-write_query = create_sql_query_chain(llm, DMdb, question_prompt)
-logger.info(f"write_query\n{str(write_query)}")
 
-execute_query = QuerySQLDataBaseTool(db=DMdb)
-logger.info(f"execute_query\n{str(execute_query)}")
+@lru_cache(maxsize=None)
+def get_chains() -> SQLChains:
+    """创建 LLM 与数据库连接, 首次调用时才连接, 导入本模块 (如服务路由) 不连接数据库"""
+    from dbsql.dmdb.loader import db
 
-answer_prompt = PromptTemplate.from_template(ANSWER_PROMPT)
-logger.info(f"answer_prompt\n{str(answer_prompt)}")
-answer = answer_prompt | llm | StrOutputParser()
-logger.info(f"answer\n{str(answer)}")
+    # TODO: 开放 LLM 配置参数
+    llm = get_gateway().chat_openai(model="qwen-coder-plus",
+                                    openai_api_key=os.getenv("DASHSCOPE_API_KEY"),
+                                    openai_api_base=os.getenv("DASHSCOPE_API_BASE"))
 
-chain = (
-        RunnablePassthrough.assign(query=write_query).assign(
-            result=(itemgetter("query") | execute_query)
-        )
-        | answer
-)
+    # llm = ChatOpenAI(model=os.getenv("MODEL_NAME"),
+    #                  openai_api_key=os.getenv("API_KEY"),
+    #                  openai_api_base=os.getenv("API_BASE"))
+
+    # Notice: you can add prompt here. And the prompt should be added here.
+    question_prompt = PromptTemplate.from_template(QUESTION_PROMPT, partial_variables={'top_k': 10, 'examples': ''})
+    logger.info(f"question_prompt\n{str(question_prompt)}")
+    write_query = create_sql_query_chain(llm, db, question_prompt)
+    logger.info(f"write_query\n{str(write_query)}")
+
+    execute_query = QuerySQLDataBaseTool(db=db)
+    logger.info(f"execute_query\n{str(execute_query)}")
+
+    answer_prompt = PromptTemplate.from_template(ANSWER_PROMPT)
+    logger.info(f"answer_prompt\n{str(answer_prompt)}")
+    answer = answer_prompt | llm | StrOutputParser()
+    logger.info(f"answer\n{str(answer)}")
+
+    chain = (
+            RunnablePassthrough.assign(query=write_query).assign(
+                result=(itemgetter("query") | execute_query)
+            )
+            | answer
+    )
+    return SQLChains(write_query, execute_query, answer, chain, db)
 
 
 def step_run(question: str, splitter_len=60) -> tuple[str, str]:
     """分步骤运行并记录各步骤结果"""
+    write_query, execute_query, answer, _, _ = get_chains()
     response = ["LLM response".center(splitter_len, "-")]
     sql_query_raw = write_query.invoke({"question": question})  # question input
     logger.info(f"llm response\n{str(sql_query_raw)}")
@@ -113,6 +130,69 @@ def step_run(question: str, splitter_len=60) -> tuple[str, str]:
         return "\n".join(response), final_answer
 
 
+async def astep_stream(question: str, splitter_len=60) -> AsyncIterator[Dict[str, Any]]:
+    """``step_run`` yielding each stage as soon as it completes, as ``DBSQLAnswer.astep_stream``:
+
+    - ``{"stage": "tables", "data": [table, ...]}``, every table goes into the prompt
+    - ``{"stage": "sql", "data": [query, ...]}``
+    - ``{"stage": "result", "data": {"query": str, "result": str}}``
+    - ``{"stage": "token", "data": str}`` for every chunk of the streamed answer
+    - ``{"stage": "done", "data": {"answer": str, "process": str}}``
+    """
+    # the first call connects to the database, keep it off the event loop
+    write_query, execute_query, answer, _, db = await asyncio.to_thread(get_chains)
+    yield {"stage": "tables", "data": list(db.get_usable_table_names())}
+
+    response = ["LLM response".center(splitter_len, "-")]
+    sql_query_raw = await write_query.ainvoke({"question": question})
+    logger.info(f"llm response\n{str(sql_query_raw)}")
+    response.append(sql_query_raw)
+    sql_queries = sql_extract(sql_query_raw)
+    yield {"stage": "sql", "data": sql_queries}
+    response.extend([f"query {i+1}: \n{query}" for i, query in enumerate(sql_queries)])
+    response.append("execution result".center(splitter_len, "-"))
+
+    successful_query = None
+    execution_result = None
+    for i, sql_query in enumerate(sql_queries):
+        try:
+            logger.info(f"try to execute query {i+1}: {sql_query}")
+            result = await execute_query.ainvoke({"query": sql_query})
+            if result.startswith("Error"):
+                raise RuntimeError(result)
+            successful_query = sql_query
+            execution_result = result
+            break
+        except Exception as e:
+            logger.error(f"query {i + 1} execute failed: {str(e)}")
+            response.append(f"query {i + 1} execute failed")
+
+    if not successful_query:
+        logger.error("cannot extract valid SQL query!" if not sql_queries else "all queries execute failed!")
+        response.append("I do not know" if not sql_queries else "all queries execute failed")
+        response.append("final response".center(splitter_len, "-"))
+        response.append("I do not know")
+        yield {"stage": "done", "data": {"answer": "I do not know", "process": "\n".join(response)}}
+        return
+
+    response.append(f"successful query: \n{successful_query}")
+    response.append(f"successful execution: \n{execution_result}")
+    yield {"stage": "result", "data": {"query": successful_query, "result": execution_result}}
+
+    response.append("final response".center(splitter_len, "-"))
+    chunks = []
+    async for chunk in answer.astream({
+        "user_question": question,
+        "sql_query": successful_query,
+        "sql_result": execution_result
+    }):
+        chunks.append(chunk)
+        yield {"stage": "token", "data": chunk}
+    final_answer = "".join(chunks)
+    response.append(final_answer)
+    yield {"stage": "done", "data": {"answer": final_answer, "process": "\n".join(response)}}
+
+
 def chain_run(question: str) -> str:
     """执行 chain 调用"""
     try:
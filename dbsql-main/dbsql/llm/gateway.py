@@ -0,0 +1,529 @@
+"""统一的大模型调用网关 (连接复用 / 并发限制 / 重试预算 / 调用统计)"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import requests
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+from requests.adapters import HTTPAdapter
+
+from dbsql import logger
+from dbsql.metrics import LLM_CALLS, LLM_SECONDS, LLM_TOKENS
+
+# statuses worth another attempt: rate limited or a struggling server
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class RetryBudget:
+    """retries shared by every caller: at most ``ratio`` of the calls made in the
+    last ``window`` seconds, plus ``min_retries``, so a failing endpoint sees a
+    bounded amount of extra load instead of every caller retrying at once.
+
+    Examples:
+        >>> budget = RetryBudget(ratio=0.2, min_retries=3)
+        >>> budget.record_call()
+        >>> budget.try_retry()
+        True
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 3, window: float = 60.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls: deque = deque()
+        self._retries: deque = deque()
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._calls.append(time.monotonic())
+
+    def try_retry(self) -> bool:
+        """take one retry from the budget, False when it is used up"""
+        with self._lock:
+            now = time.monotonic()
+            for events in (self._calls, self._retries):
+                while events and now - events[0] > self.window:
+                    events.popleft()
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._calls):
+                return False
+            self._retries.append(now)
+            return True
+
+
+@dataclass
+class ModelStats:
+    """accounting of the calls made to one model"""
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats = asdict(self)
+        stats["avg_latency"] = self.latency / self.calls if self.calls else 0.0
+        return stats
+
+
+def _response_usage(data: Dict) -> Tuple[int, int]:
+    """prompt and completion tokens of an Ollama or OpenAI style json response"""
+    if "usage" in data:
+        usage = data["usage"] or dict()
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return data.get("prompt_eval_count", 0), data.get("eval_count", 0)
+
+
+def _result_usage(result: ChatResult) -> Tuple[int, int]:
+    """prompt and completion tokens of a LangChain chat result, whatever the provider"""
+    usage = (result.llm_output or dict()).get("token_usage")
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    prompt_tokens = completion_tokens = 0
+    for generation in result.generations:
+        chunk_prompt, chunk_completion = _generation_usage(generation)
+        prompt_tokens += chunk_prompt
+        completion_tokens += chunk_completion
+    return prompt_tokens, completion_tokens
+
+
+def _generation_usage(generation: ChatGeneration) -> Tuple[int, int]:
+    metadata = getattr(generation.message, "usage_metadata", None)
+    if metadata:
+        return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+    info = generation.generation_info or dict()
+    return info.get("prompt_eval_count", 0) or 0, info.get("eval_count", 0) or 0
+
+
+# exception classes (and their bases) of failed connections in requests, httpx and the openai SDK
+_RETRY_ERRORS = {"ConnectionError", "Timeout", "TransportError", "APIConnectionError"}
+
+
+def _retryable(error: BaseException) -> bool:
+    """whether ``error`` is worth another attempt: a failed connection, a timeout or 429/5xx"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status is not None:
+        return status in _RETRY_STATUS
+    return any(cls.__name__ in _RETRY_ERRORS for cls in type(error).__mro__)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Slots:
+    """counting semaphore shared by threads and coroutines. Threads wait on a
+    condition, coroutines await a future of their own loop, so a waiting
+    coroutine never holds an executor thread and the event loop never blocks."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._used = 0
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._used >= self.limit:
+                self._condition.wait()
+            self._used += 1
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._used < self.limit:
+                    self._used += 1
+                    return
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def release(self) -> None:
+        with self._condition:
+            self._used -= 1
+            self._condition.notify()
+            # every waiting coroutine checks again, those that lose the slot wait anew
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:  # its loop is closed
+                pass
+
+
+class GatewayChatModel(BaseChatModel):
+    """chat model calling ``llm`` within the gateway's concurrency limits and retry
+    budget, with its latency and token usage recorded under ``model``.
+
+    The limits are taken around the model call itself, not in a callback: the
+    async paths await a free slot instead of blocking an executor thread, and
+    streams hold their slot until the last chunk. Streams are not retried, part
+    of the answer may already be delivered.
+    """
+    llm: BaseChatModel
+    gateway: Any = Field(exclude=True)
+    model: str
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.llm._identifying_params
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        return self.gateway.call(
+            self.model,
+            lambda: self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            _result_usage,
+        )
+
+    async def _agenerate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        return await self.gateway.acall(
+            self.model,
+            lambda: self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            _result_usage,
+        )
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        with self.gateway.slot(self.model):
+            usage = [0, 0]
+            started = time.perf_counter()
+            try:
+                for chunk in self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    _add_usage(usage, chunk)
+                    yield chunk
+            except Exception:
+                self.gateway.record(self.model, time.perf_counter() - started, failed=True)
+                raise
+            self.gateway.record(self.model, time.perf_counter() - started, *usage)
+
+    async def _astream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.gateway.aslot(self.model):
+            usage = [0, 0]
+            started = time.perf_counter()
+            try:
+                async for chunk in self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    _add_usage(usage, chunk)
+                    yield chunk
+            except Exception:
+                self.gateway.record(self.model, time.perf_counter() - started, failed=True)
+                raise
+            self.gateway.record(self.model, time.perf_counter() - started, *usage)
+
+
+def _add_usage(usage: List[int], chunk: ChatGenerationChunk) -> None:
+    prompt_tokens, completion_tokens = _generation_usage(chunk)
+    usage[0] += prompt_tokens
+    usage[1] += completion_tokens
+
+
+class LLMGateway:
+    """single way out to the LLM endpoints.
+
+    - one keep-alive ``requests.Session`` (and httpx clients for OpenAI models)
+    - a global and a per-model concurrency limit, shared by threads and coroutines
+    - a retry budget shared by every caller, with exponential backoff; the
+      OpenAI SDK does not retry on its own, so LangChain models retry here too
+    - per-model call, failure, latency and token accounting (``stats``)
+
+    Args:
+        max_concurrency: calls in flight over all models.
+        model_concurrency: calls in flight per model, ``{model: limit}``.
+        default_model_concurrency: limit of models missing from ``model_concurrency``.
+        max_retries: retries of one call, when the budget allows them.
+        backoff: seconds before the first retry, doubled for every next one.
+        retry_budget: shared budget, a default ``RetryBudget`` when None.
+        pool_size: keep-alive connections per host.
+        timeout: default request timeout in seconds.
+
+    Examples:
+        >>> gateway = get_gateway()
+        >>> gateway.ollama_chat(base_url, "deepseek-r1:14b", [{"role": "user", "content": "你好"}])
+        >>> llm = gateway.chat_ollama(model="deepseek-r1:14b", base_url=base_url)
+        >>> gateway.stats()["deepseek-r1:14b"]["avg_latency"]
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 4,
+            model_concurrency: Optional[Dict[str, int]] = None,
+            default_model_concurrency: int = 2,
+            max_retries: int = 2,
+            backoff: float = 1.0,
+            retry_budget: Optional[RetryBudget] = None,
+            pool_size: int = 8,
+            timeout: float = 300.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = dict(model_concurrency or dict())
+        self.default_model_concurrency = default_model_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_budget = retry_budget or RetryBudget()
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._global_slots = _Slots(max_concurrency)
+        self._model_slots: Dict[str, _Slots] = dict()
+        self._stats: Dict[str, ModelStats] = dict()
+        self._session: Optional[requests.Session] = None
+        self._http_client = None
+        self._http_async_client = None
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def acquire(self, model: str) -> None:
+        """wait for a slot of ``model`` and then a global one"""
+        self._model_slot(model).acquire()
+        self._global_slots.acquire()
+
+    def release(self, model: str) -> None:
+        self._global_slots.release()
+        self._model_slot(model).release()
+
+    async def aacquire(self, model: str) -> None:
+        """``acquire`` for coroutines, awaiting the slots without blocking the loop"""
+        model_slot = self._model_slot(model)
+        await model_slot.aacquire()
+        try:
+            await self._global_slots.aacquire()
+        except BaseException:
+            model_slot.release()
+            raise
+
+    @contextmanager
+    def slot(self, model: str) -> Iterator[None]:
+        self.acquire(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    @asynccontextmanager
+    async def aslot(self, model: str) -> AsyncIterator[None]:
+        await self.aacquire(model)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def record(
+            self,
+            model: str,
+            latency: float,
+            prompt_tokens: int = 0,
+            completion_tokens: int = 0,
+            failed: bool = False,
+            retried: bool = False,
+    ) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(model, ModelStats())
+            stats.calls += 1
+            stats.failures += int(failed)
+            stats.retries += int(retried)
+            stats.latency += latency
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+        LLM_SECONDS.observe(latency, model=model)
+        LLM_CALLS.inc(model=model, result="failure" if failed else "success")
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """``{model: {"calls", "failures", "retries", "latency", "avg_latency", ...}}``"""
+        with self._lock:
+            return {model: stats.to_dict() for model, stats in self._stats.items()}
+
+    def call(self, model: str, func: Callable[[], T], usage: Callable[[T], Tuple[int, int]]) -> T:
+        """``func()`` within the limits of ``model``, retrying connection errors,
+        timeouts and 429/5xx responses while the retry budget allows"""
+        self.retry_budget.record_call()
+        for attempt in range(self.max_retries + 1):
+            with self.slot(model):
+                # latency of the call itself, not of waiting for a slot
+                started = time.perf_counter()
+                try:
+                    result = func()
+                except Exception as error:
+                    self.record(model, time.perf_counter() - started, failed=True, retried=attempt > 0)
+                    wait_time = self._retry_wait(model, error, attempt)
+                else:
+                    self.record(model, time.perf_counter() - started, *usage(result), retried=attempt > 0)
+                    return result
+            time.sleep(wait_time)
+
+    async def acall(self, model: str, func: Callable[[], Awaitable[T]], usage: Callable[[T], Tuple[int, int]]) -> T:
+        """``call`` for coroutines: ``func()`` returns the awaitable to run"""
+        self.retry_budget.record_call()
+        for attempt in range(self.max_retries + 1):
+            async with self.aslot(model):
+                started = time.perf_counter()
+                try:
+                    result = await func()
+                except Exception as error:
+                    self.record(model, time.perf_counter() - started, failed=True, retried=attempt > 0)
+                    wait_time = self._retry_wait(model, error, attempt)
+                else:
+                    self.record(model, time.perf_counter() - started, *usage(result), retried=attempt > 0)
+                    return result
+            await asyncio.sleep(wait_time)
+
+    def _retry_wait(self, model: str, error: Exception, attempt: int) -> float:
+        """seconds before retrying after ``error``, raises it when there is no retry left"""
+        if not _retryable(error) or attempt >= self.max_retries or not self.retry_budget.try_retry():
+            raise error
+        wait_time = self.backoff * 2 ** attempt
+        logger.warning(f"LLM call to {model} failed ({error}), retry in {wait_time:.1f}s")
+        return wait_time
+
+    def post_json(self, url: str, payload: Dict, model: str, timeout: Optional[float] = None) -> Dict:
+        """POST ``payload`` and return the json response, retried as in ``call``"""
+        def post() -> Dict:
+            response = self.session.post(url, json=payload, timeout=timeout or self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+        return self.call(model, post, _response_usage)
+
+    def ollama_chat(
+            self,
+            base_url: str,
+            model: str,
+            messages: List[Dict[str, str]],
+            options: Optional[Dict[str, Any]] = None,
+            timeout: Optional[float] = None,
+    ) -> str:
+        """reply of Ollama's ``/api/chat``"""
+        payload = {"model": model, "messages": messages, "stream": False}
+        if options:
+            payload["options"] = options
+        data = self.post_json(f"{base_url.rstrip('/')}/api/chat", payload, model, timeout)
+        return ((data or dict()).get("message") or dict()).get("content", "").strip()
+
+    def ollama_generate(
+            self,
+            base_url: str,
+            model: str,
+            prompt: str,
+            options: Optional[Dict[str, Any]] = None,
+            timeout: Optional[float] = None,
+    ) -> str:
+        """completion of Ollama's ``/api/generate``"""
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        if options:
+            payload["options"] = options
+        data = self.post_json(f"{base_url.rstrip('/')}/api/generate", payload, model, timeout)
+        return (data or dict()).get("response") or ""
+
+    def chat_openai(self, model: str, **kwargs: Any) -> GatewayChatModel:
+        """``ChatOpenAI`` on the gateway's pooled http clients, limits and retry budget"""
+        import httpx
+        from langchain_openai import ChatOpenAI
+
+        with self._lock:
+            if self._http_client is None:
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                self._http_client = httpx.Client(limits=limits, timeout=self.timeout)
+                self._http_async_client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        # retries go through the shared budget, an SDK retrying on its own would bypass it
+        kwargs.setdefault("max_retries", 0)
+        llm = ChatOpenAI(
+            model=model,
+            http_client=self._http_client,
+            http_async_client=self._http_async_client,
+            **kwargs,
+        )
+        return GatewayChatModel(llm=llm, gateway=self, model=model)
+
+    def chat_ollama(self, model: str, base_url: str, **kwargs: Any) -> GatewayChatModel:
+        """``ChatOllama`` within the gateway's limits, retry budget and accounting"""
+        from langchain_community.chat_models import ChatOllama
+
+        return GatewayChatModel(llm=ChatOllama(model=model, base_url=base_url, **kwargs), gateway=self, model=model)
+
+    def close(self) -> None:
+        with self._lock:
+            session, self._session = self._session, None
+            http_client, self._http_client = self._http_client, None
+            self._http_async_client = None
+        if session is not None:
+            session.close()
+        if http_client is not None:
+            http_client.close()
+
+    def _model_slot(self, model: str) -> _Slots:
+        with self._lock:
+            if model not in self._model_slots:
+                limit = self.model_concurrency.get(model, self.default_model_concurrency)
+                self._model_slots[model] = _Slots(limit)
+            return self._model_slots[model]
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """the process-wide gateway, limits from ``DBSQL_LLM_CONCURRENCY`` and
+    ``DBSQL_LLM_MODEL_CONCURRENCY``"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(
+                max_concurrency=int(os.getenv("DBSQL_LLM_CONCURRENCY", "4")),
+                default_model_concurrency=int(os.getenv("DBSQL_LLM_MODEL_CONCURRENCY", "2")),
+            )
+        return _gateway
@@ -48,7 +48,7 @@ Given an input question, first create a syntactically correct MySQL query to run
 - An example of your reply: 
   - ```sql\nSELECT * FROM DB_TEST.FLOW_WORK_ATDO WHERE BUSINESS_CATE = '中央' LIMIT 5;\n```
 
-### User Question
+{examples}### User Question
 The query will be generated based on the following question:
 {input}
 
@@ -71,3 +71,27 @@ Question: {user_question}
 SQL Query: {sql_query}
 SQL Result: {sql_result}
 Answer: """
+
+REPAIR_PROMPT = """### Task
+The following SQL query was written to answer the user question, but it is invalid. Fix the query so that it runs on the database schema below and still answers the question.
+
+### Instructions
+- Use only the tables and column names you can see in the schema. Be careful to not query for columns that do not exist.
+- Keep the query as close to the original as possible, change only what the errors require.
+- Reply with exactly one query in the format:
+  - ```sql\nSELECT ...;\n```
+
+### User Question
+{question}
+
+### Invalid SQL
+{sql_query}
+
+### Errors
+{errors}
+
+### Database Schema
+{table_info}
+
+### Fixed SQL
+"""
@@ -0,0 +1,180 @@
+"""已验证的 问题 -> SQL 记忆 (字符 n-gram TF-IDF 相似度检索)"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from dbsql import logger
+from dbsql.cache import normalize_question
+from dbsql.routing import tokenize
+
+# words that do not change what a question asks for
+_FILLERS = re.compile(r"请问|请|帮我|帮忙|一下|查询|查一下|查看|告诉我|我想知道|的|了|吗|呢|啊|呀|吧")
+_CONTENT = re.compile(r"[0-9a-z一-鿿]")
+
+
+def _features(question: str) -> Counter:
+    """character bigrams and single characters of the normalized question"""
+    question = normalize_question(question)
+    return Counter(tokenize(question) + re.findall(r"[一-鿿]", question))
+
+
+def _content(question: str) -> str:
+    """the characters that carry meaning, in order: no fillers, spaces or punctuation"""
+    return "".join(_CONTENT.findall(_FILLERS.sub("", normalize_question(question))))
+
+
+class QueryMemory:
+    """store of ``(question, sql)`` pairs whose SQL ran successfully, searched by
+    cosine similarity of character n-gram TF-IDF vectors.
+
+    ``match`` returns a stored pair to reuse directly: the score must reach
+    ``reuse_threshold`` and both questions must read the same once fillers like
+    "请问", spaces and punctuation are removed, so "去年" and "今年", "2021年"
+    and "2012年" or "比2022年多" and "比2023年多" never share a query; order
+    matters. ``examples`` formats the closest pairs as
+    few-shot examples for ``QUESTION_PROMPT``.
+
+    Args:
+        path: json file the pairs are kept in, None to keep them in memory only.
+        max_entries: the least recently used pairs beyond this are dropped.
+        reuse_threshold: lowest similarity at which stored SQL is reused.
+        example_threshold: lowest similarity of a few-shot example.
+
+    Examples:
+        >>> memory = QueryMemory("data/query_memory.json")
+        >>> memory.add("去年的投诉有多少?", "SELECT COUNT(*) FROM 虚假宣传 WHERE ...")
+        >>> memory.match("请问去年投诉有多少")["sql"]
+        'SELECT COUNT(*) FROM 虚假宣传 WHERE ...'
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            max_entries: int = 2000,
+            reuse_threshold: float = 0.85,
+            example_threshold: float = 0.3,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.reuse_threshold = reuse_threshold
+        self.example_threshold = example_threshold
+        self._lock = threading.Lock()
+        # normalized question -> {"question", "sql", "created_at", "used_at"}
+        self._entries: Dict[str, Dict] = dict()
+        self._vectors: Dict[str, Dict[str, float]] = dict()
+        self._index: Dict[str, Set[str]] = defaultdict(set)
+        self._idf: Dict[str, float] = dict()
+        self._dirty = False
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, question: str, sql: str) -> None:
+        """remember that ``sql`` answered ``question``"""
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["sql"] == sql:
+                entry["used_at"] = now
+                return
+            self._entries[key] = {"question": question, "sql": sql, "created_at": now, "used_at": now}
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["used_at"])
+                del self._entries[oldest]
+            self._dirty = True
+            self._save()
+
+    def forget(self, question: str) -> None:
+        """drop the pair of ``question``, e.g. when its SQL no longer runs"""
+        with self._lock:
+            if self._entries.pop(normalize_question(question), None) is not None:
+                self._dirty = True
+                self._save()
+
+    def search(self, question: str, k: int = 3) -> List[Tuple[float, Dict]]:
+        """the at most ``k`` most similar pairs as ``(score, entry)``, best first"""
+        with self._lock:
+            if self._dirty:
+                self._rebuild()
+            query = self._vector(_features(question))
+            candidates = set()
+            for term in query:
+                candidates.update(self._index.get(term, ()))
+            scores = []
+            for key in candidates:
+                vector = self._vectors[key]
+                score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+                scores.append((score, dict(self._entries[key])))
+        scores.sort(key=lambda item: item[0], reverse=True)
+        return scores[:k]
+
+    def match(self, question: str) -> Optional[Dict]:
+        """a stored pair whose SQL answers ``question`` as well, None when there is none"""
+        for score, entry in self.search(question, k=1):
+            if score >= self.reuse_threshold and _content(entry["question"]) == _content(question):
+                logger.info(f"query memory match ({score:.2f}): {entry['question']}")
+                with self._lock:
+                    stored = self._entries.get(normalize_question(entry["question"]))
+                    if stored is not None:
+                        stored["used_at"] = time.time()
+                return entry
+        return None
+
+    def examples(self, question: str, k: int = 3) -> str:
+        """the closest pairs formatted for the ``{examples}`` slot of ``QUESTION_PROMPT``"""
+        pairs = [entry for score, entry in self.search(question, k) if score >= self.example_threshold]
+        if not pairs:
+            return ""
+        lines = ["### Examples", "Queries that answered similar questions:"]
+        for entry in pairs:
+            lines.append(f"Question: {entry['question']}")
+            lines.append(f"```sql\n{entry['sql']}\n```")
+        return "\n".join(lines) + "\n\n"
+
+    def _vector(self, features: Counter) -> Dict[str, float]:
+        vector = {term: count * self._idf[term] for term, count in features.items() if term in self._idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else dict()
+
+    def _rebuild(self) -> None:
+        features = {key: _features(entry["question"]) for key, entry in self._entries.items()}
+        doc_freqs = Counter()
+        for counts in features.values():
+            doc_freqs.update(counts.keys())
+        n = len(features)
+        self._idf = {term: math.log((1 + n) / (1 + df)) + 1 for term, df in doc_freqs.items()}
+        self._vectors = {key: self._vector(counts) for key, counts in features.items()}
+        self._index = defaultdict(set)
+        for key, vector in self._vectors.items():
+            for term in vector:
+                self._index[term].add(key)
+        self._dirty = False
+
+    def _load(self) -> None:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as error:
+            logger.warning(f"ignore unreadable query memory {self.path}: {error}")
+            return
+        self._entries = {normalize_question(entry["question"]): entry for entry in entries}
+        self._dirty = True
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._entries.values()), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
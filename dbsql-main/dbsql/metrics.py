@@ -0,0 +1,175 @@
+"""进程内运行指标 (Prometheus 文本格式)"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_INF = 'le="+Inf"'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """a named metric with a fixed set of label names"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), registry: Optional[Registry] = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """monotonically increasing count per label set
+
+    Examples:
+        >>> QUESTIONS.inc(outcome="success")
+    """
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = dict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}" for key, value in values]
+
+
+class Histogram(Metric):
+    """distribution of observed values (seconds) in cumulative buckets
+
+    Examples:
+        >>> with STAGE_SECONDS.time(stage="execution"):
+        ...     db.query(sql)
+    """
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, +Inf count, sum)
+        self._values: Dict[Tuple[str, ...], List] = dict()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, _, _ = entry = self._values.setdefault(key, [[0] * len(self.buckets), 0, 0.0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """observe the seconds spent in the block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, value_sum)) for key, (counts, total, value_sum) in self._values.items())
+        lines = []
+        for key, (counts, total, value_sum) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, _INF)} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {repr(float(value_sum))}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {total}")
+        return lines
+
+
+class Registry:
+    """the metrics of the process, rendered together for ``/metrics``"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = dict()
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# stages: routing, sql_generation, execution, repair, answer, total
+STAGE_SECONDS = Histogram("dbsql_stage_seconds", "Latency of each question answering stage.", ["stage"])
+# outcomes: success, unknown ("I do not know"), failure
+QUESTIONS = Counter("dbsql_questions_total", "Questions answered, by outcome.", ["outcome"])
+# caches: answer, result, query_memory
+CACHE_REQUESTS = Counter("dbsql_cache_requests_total", "Cache lookups, by cache and result.", ["cache", "result"])
+# methods: router, llm
+TABLE_ROUTING = Counter("dbsql_table_routing_total", "Table selections, by method.", ["method"])
+PROMPT_TOKENS = Counter("dbsql_prompt_tokens_total", "Tokens sent in prompts, by stage.", ["stage"])
+
+LLM_SECONDS = Histogram("dbsql_llm_call_seconds", "Latency of LLM calls through the gateway.", ["model"])
+LLM_CALLS = Counter("dbsql_llm_calls_total", "LLM calls through the gateway, by result.", ["model", "result"])
+LLM_TOKENS = Counter("dbsql_llm_tokens_total", "Tokens reported by the LLM endpoints.", ["model", "kind"])
+
+
+def record_question(outcome: str, seconds: Optional[float] = None) -> None:
+    QUESTIONS.inc(outcome=outcome)
+    if seconds is not None:
+        STAGE_SECONDS.observe(seconds, stage="total")
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1 @@
+from .mysql_database import MySQLDatabase
\ No newline at end of file
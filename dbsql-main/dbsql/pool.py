@@ -0,0 +1,346 @@
+"""线程安全的有界数据库连接池"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Iterator, Optional
+
+from dbsql import logger
+
+
+class PoolTimeout(RuntimeError):
+    """raised when no connection can be acquired within the acquire timeout"""
+
+
+class PoolClosed(RuntimeError):
+    """raised when acquiring from a pool that has been closed"""
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    """snapshot of the pool state, used to size the pool under load"""
+    max_size: int
+    size: int
+    idle: int
+    in_use: int
+    waiting: int
+    created: int
+    closed: int
+    timeouts: int
+
+
+class StatementCache:
+    """per-connection LRU cache of prepared cursors keyed by SQL text.
+
+    Re-executing the same statement text on the same cursor lets drivers such as
+    dmPython skip the server-side hard parse, which matters for query templates
+    (catalog lookups, sample rows) that run thousands of times a day.
+
+    Args:
+        connection: the DB-API connection that owns the cursors.
+        size: maximum number of cached statements, 0 disables caching.
+    """
+
+    def __init__(self, connection: Any, size: int = 32):
+        self._connection = connection
+        self.size = size
+        self._cursors: OrderedDict[str, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cursor(self, sql: str):
+        """get the cached cursor prepared for ``sql``, preparing a new one on a miss"""
+        cursor = self._cursors.get(sql)
+        if cursor is not None:
+            self._cursors.move_to_end(sql)
+            self.hits += 1
+            return cursor
+
+        self.misses += 1
+        cursor = self._connection.cursor()
+        prepare = getattr(cursor, "prepare", None)
+        if prepare is not None:
+            prepare(sql)
+        if self.size > 0:
+            self._cursors[sql] = cursor
+            while len(self._cursors) > self.size:
+                _, evicted = self._cursors.popitem(last=False)
+                self._close_cursor(evicted)
+        return cursor
+
+    def discard(self, sql: str) -> None:
+        """forget the cursor of ``sql``, e.g. after its execution failed"""
+        cursor = self._cursors.pop(sql, None)
+        if cursor is not None:
+            self._close_cursor(cursor)
+
+    def clear(self) -> None:
+        while self._cursors:
+            _, cursor = self._cursors.popitem()
+            self._close_cursor(cursor)
+
+    def __len__(self) -> int:
+        return len(self._cursors)
+
+    @staticmethod
+    def _close_cursor(cursor: Any) -> None:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+class PooledConnection:
+    """a driver connection owned by a ConnectionPool.
+
+    Attributes:
+        raw: the underlying DB-API connection.
+        statements: cache of prepared cursors living on this connection.
+        created_at: monotonic time when the connection was opened.
+        last_used: monotonic time when the connection was last released.
+        broken: set to True to make the pool discard the connection on release.
+        suspect: set when the last use raised, forces a health check on next acquire.
+    """
+
+    def __init__(self, raw: Any, statement_cache_size: int = 32):
+        self.raw = raw
+        self.statements = StatementCache(raw, statement_cache_size)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+        self.suspect = False
+
+    def cursor(self):
+        return self.raw.cursor()
+
+    def invalidate(self) -> None:
+        self.broken = True
+
+    def cancel(self) -> None:
+        """interrupt the statement running on this connection from another thread.
+
+        Uses the driver's ``cancel()`` when it has one and closes the connection
+        otherwise; either way the connection is discarded on release.
+        """
+        self.broken = True
+        cancel = getattr(self.raw, "cancel", None)
+        if cancel is not None:
+            cancel()
+        else:
+            self.raw.close()
+
+
+class ConnectionPool:
+    """a bounded pool of DB-API connections.
+
+    Connections are created lazily by ``creator`` up to ``max_size``. Idle
+    connections older than ``max_idle_time`` are closed instead of reused, and
+    connections that were idle for longer than ``health_check_interval`` (or whose
+    last use raised) are pinged with ``health_check_query`` before being handed out.
+
+    Args:
+        creator: callable returning a new DB-API connection.
+        max_size: maximum number of open connections.
+        acquire_timeout: seconds to wait for a free connection before raising PoolTimeout.
+        max_idle_time: seconds an idle connection may stay in the pool.
+        health_check_query: query used to check a connection, None to disable checks.
+        health_check_interval: idle seconds after which a connection is checked on acquire.
+        statement_cache_size: prepared statements cached per connection, 0 to disable.
+
+    Examples:
+        >>> pool = ConnectionPool(lambda: dmPython.connect(...), max_size=4)
+        >>> with pool.connection() as conn:
+        ...     cursor = conn.cursor()
+        ...     cursor.execute("SELECT 1 FROM DUAL")
+    """
+
+    def __init__(
+            self,
+            creator: Callable[[], Any],
+            max_size: int = 5,
+            acquire_timeout: float = 30.0,
+            max_idle_time: float = 300.0,
+            health_check_query: Optional[str] = "SELECT 1",
+            health_check_interval: float = 30.0,
+            statement_cache_size: int = 32,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self._creator = creator
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_idle_time = max_idle_time
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+        self.statement_cache_size = statement_cache_size
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: Deque[PooledConnection] = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._closed_count = 0
+        self._timeouts = 0
+        self._closed = False
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """borrow a connection, waiting at most ``timeout`` seconds for one to be free"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            conn, create, expired = self._reserve(deadline)
+            for old in expired:
+                self._close_raw(old)
+            if create:
+                try:
+                    conn = PooledConnection(self._creator(), self.statement_cache_size)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                return conn
+
+            if self._needs_check(conn) and not self._check(conn):
+                self._discard(conn)
+                continue
+            return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        """give a borrowed connection back to the pool"""
+        if conn.broken or self._closed:
+            self._discard(conn)
+            return
+
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[PooledConnection]:
+        """borrow a connection for the duration of a ``with`` block"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            conn.suspect = True
+            try:
+                conn.raw.rollback()
+            except Exception:
+                conn.broken = True
+            raise
+        finally:
+            self.release(conn)
+
+    def stats(self) -> PoolStats:
+        with self._cond:
+            return PoolStats(
+                max_size=self.max_size,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                waiting=self._waiting,
+                created=self._created,
+                closed=self._closed_count,
+                timeouts=self._timeouts,
+            )
+
+    def close(self) -> None:
+        """close idle connections and refuse new acquires; borrowed ones close on release"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._closed_count += len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_raw(conn)
+
+    def _reserve(self, deadline: float):
+        """take an idle connection or a slot to create one, returns (conn, create, expired)"""
+        expired = []
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("connection pool is closed")
+
+                    conn = None
+                    now = time.monotonic()
+                    # idle connections are ordered oldest first, reuse the warmest one
+                    while self._idle and now - self._idle[0].last_used > self.max_idle_time:
+                        expired.append(self._idle.popleft())
+                        self._size -= 1
+                        self._closed_count += 1
+                    if self._idle:
+                        conn = self._idle.pop()
+
+                    if conn is not None:
+                        self._in_use += 1
+                        return conn, False, expired
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._in_use += 1
+                        return None, True, expired
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"no free connection after waiting, pool stats: {self._stats_unlocked()}"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _needs_check(self, conn: PooledConnection) -> bool:
+        if self.health_check_query is None:
+            return False
+        return conn.suspect or time.monotonic() - conn.last_used > self.health_check_interval
+
+    def _check(self, conn: PooledConnection) -> bool:
+        try:
+            cursor = conn.raw.cursor()
+            try:
+                cursor.execute(self.health_check_query)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception as error:
+            logger.warning(f"discard unhealthy pooled connection: {error}")
+            return False
+        conn.suspect = False
+        return True
+
+    def _discard(self, conn: PooledConnection) -> None:
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._closed_count += 1
+            self._cond.notify()
+        self._close_raw(conn)
+
+    @staticmethod
+    def _close_raw(conn: PooledConnection) -> None:
+        conn.statements.clear()
+        try:
+            conn.raw.close()
+        except Exception:
+            pass
+
+    def _stats_unlocked(self) -> str:
+        return (f"size={self._size}/{self.max_size}, idle={len(self._idle)}, "
+                f"in_use={self._in_use}, waiting={self._waiting}")
@@ -0,0 +1,150 @@
+"""离线列统计 (列画像) 的生成与存储, 用于在 prompt 中代替实时示例数据"""
+from __future__ import annotations
+
+import datetime
+import decimal
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from dbsql import logger
+
+# a column is treated as categorical (and gets top-K values) below this distinct ratio
+CATEGORICAL_RATIO = 0.5
+_RANGE_TYPES = (int, float, decimal.Decimal, datetime.date, datetime.datetime)
+
+
+def _quote(db, name: str) -> str:
+    if db.dialect == "dameng":
+        return '"{}"'.format(name.replace('"', '""'))
+    return "`{}`".format(name.replace("`", "``"))
+
+
+def _table_ref(db, table: str) -> str:
+    if db.dialect == "dameng":
+        return f"{db.database}.{_quote(db, table)}"
+    return _quote(db, table)
+
+
+def _plain(value: Any) -> Union[str, int, float, None]:
+    """convert a driver value to something json can store"""
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def profile_table(db, table: str, top_k: int = 5) -> Dict[str, Any]:
+    """compute row count, null ratio, distinct count, min/max of numbers and dates
+    and the top-K values of categorical columns of ``table``.
+
+    Args:
+        db: a DMDatabase or MySQLDatabase.
+        table: the table to profile.
+        top_k: number of most frequent values kept for categorical columns.
+
+    Returns:
+        Dict[str, Any]: ``{"row_count": int, "profiled_at": float, "columns": {name: stats}}``
+    """
+    table_ref = _table_ref(db, table)
+    columns = db.query(f"SELECT * FROM {table_ref} WHERE 1 = 0").columns
+    row_count = db.query(f"SELECT COUNT(*) FROM {table_ref}", max_rows=1, timeout=0).rows[0][0]
+
+    profile = {"row_count": int(row_count), "profiled_at": time.time(), "columns": dict()}
+    for column in columns:
+        column_ref = _quote(db, column)
+        try:
+            non_null, distinct, minimum, maximum = db.query(
+                f"SELECT COUNT({column_ref}), COUNT(DISTINCT {column_ref}), "
+                f"MIN({column_ref}), MAX({column_ref}) FROM {table_ref}",
+                max_rows=1, timeout=0,
+            ).rows[0]
+        except Exception as error:
+            # e.g. CLOB columns cannot be compared or counted distinctly
+            logger.warning(f"skip profiling {table}.{column}: {error}")
+            continue
+
+        stats = {
+            "null_ratio": round(1 - non_null / row_count, 4) if row_count else 0.0,
+            "distinct": int(distinct),
+        }
+        if isinstance(minimum, _RANGE_TYPES) and not isinstance(minimum, bool):
+            stats["min"] = _plain(minimum)
+            stats["max"] = _plain(maximum)
+        if top_k > 0 and non_null and distinct <= CATEGORICAL_RATIO * non_null:
+            top = db.query(
+                f"SELECT {column_ref}, COUNT(*) AS cnt FROM {table_ref} "
+                f"WHERE {column_ref} IS NOT NULL GROUP BY {column_ref} ORDER BY cnt DESC LIMIT {int(top_k)}",
+                max_rows=top_k, timeout=0,
+            ).rows
+            stats["top"] = [[_plain(value), int(count)] for value, count in top]
+        profile["columns"][column] = stats
+    return profile
+
+
+class ProfileStore:
+    """column profiles of every table, stored in a local json file.
+
+    Examples:
+        >>> store = ProfileStore("data/table_profile.json")
+        >>> store.build(db)
+        >>> print(store.render("虚假信息"))
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.profiles: Dict[str, Dict[str, Any]] = dict()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.profiles = json.load(f)
+
+    def __contains__(self, table: str) -> bool:
+        return table in self.profiles
+
+    def build(self, db, tables: Optional[Iterable[str]] = None, top_k: int = 5) -> None:
+        """profile ``tables`` (every usable table when None) and save after each one"""
+        tables = list(db.get_usable_table_names()) if tables is None else list(tables)
+        for i, table in enumerate(tables):
+            logger.info(f"profiling table {table} ({i + 1}/{len(tables)})")
+            self.profiles[table] = profile_table(db, table, top_k)
+            self.save()
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.profiles, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def render(self, table: str) -> str:
+        """render the profile of ``table`` as compact prompt text"""
+        profile = self.profiles[table]
+        lines: List[str] = [f"共 {profile['row_count']} 行"]
+        for column, stats in profile["columns"].items():
+            parts = [f"空值 {stats['null_ratio']:.1%}", f"不同值 {stats['distinct']}"]
+            if "min" in stats:
+                parts.append(f"范围 {stats['min']} ~ {stats['max']}")
+            if stats.get("top"):
+                parts.append("常见值: " + ", ".join(f"{value}({count})" for value, count in stats["top"]))
+            lines.append(f"- {column}: " + ", ".join(parts))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+    from urllib.parse import quote_plus as urlquote
+
+    from dotenv import load_dotenv
+
+    from dbsql.mysqldb import MySQLDatabase
+
+    load_dotenv()
+    host = os.environ.get("DB_HOST", "localhost")
+    port = os.environ.get("DB_PORT", "3306")
+    user = os.environ.get("DB_USER", "root")
+    passwd = urlquote(os.environ.get("DB_PASSWD", ""))
+    name = os.environ.get("DB_NAME", "NLP_DB_BY_TYPE")
+    output = sys.argv[1] if len(sys.argv) > 1 else "table_profile.json"
+
+    ProfileStore(output).build(MySQLDatabase.from_uri(f"mysql+pymysql://{user}:{passwd}@{host}:{port}/{name}"))
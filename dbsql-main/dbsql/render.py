@@ -0,0 +1,117 @@
+"""查询结果的本地渲染 (标量 -> 中文句子, 小结果集 -> markdown 表格)"""
+from __future__ import annotations
+
+import datetime
+import decimal
+import re
+from typing import Any, Dict, Optional
+
+from dbsql.result import QueryResult
+
+# questions that ask for interpretation rather than the data itself still go to the LLM
+_REASONING_WORDS = ("为什么", "原因", "分析", "比较", "对比", "趋势", "建议", "总结", "解释", "是否", "评价", "预测")
+_PLAIN_LABEL = re.compile(r"^[\w一-鿿]+$")
+_CJK = re.compile(r"[一-鿿]")
+# a description is cut at its first clause: "发文的唯一标识，主键" -> "发文的唯一标识"
+_CLAUSE_END = re.compile(r"[，,。.；;：:（(]")
+_MAX_LABEL_CHARS = 16
+
+
+def format_value(value: Any) -> str:
+    """text of a single result value"""
+    if value is None:
+        return "空"
+    if isinstance(value, bool):
+        return "是" if value else "否"
+    if isinstance(value, float):
+        return f"{value:.4f}".rstrip("0").rstrip(".")
+    if isinstance(value, decimal.Decimal):
+        text = format(value, "f")
+        return text.rstrip("0").rstrip(".") if "." in text else text
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return str(value).replace("\n", " ").strip()
+
+
+def column_labels(table_info: Dict[str, Dict]) -> Dict[str, str]:
+    """lowercase column name -> short Chinese label, taken from the ``表结构``
+    column descriptions of the described tables"""
+    labels = dict()
+    for info in table_info.values():
+        for column, description in (info.get("表结构") or dict()).items():
+            label = _CLAUSE_END.split(str(description).strip(), 1)[0].strip()
+            if label and len(label) <= _MAX_LABEL_CHARS:
+                labels.setdefault(column.lower(), label)
+    return labels
+
+
+def _label(column: str, labels: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """a Chinese label of the column: its description, or the name itself when it
+    is Chinese. None for identifiers like ``total_count`` and expressions like
+    ``COUNT(*)``, which do not belong in a Chinese sentence"""
+    column = column.strip("`\"")
+    label = (labels or dict()).get(column.lower())
+    if label is None and _PLAIN_LABEL.match(column):
+        label = column
+    return label if label is not None and _CJK.search(label) else None
+
+
+def _cell(value: Any) -> str:
+    return format_value(value).replace("|", "\\|")
+
+
+def render_answer(
+        question: str,
+        result: QueryResult,
+        labels: Optional[Dict[str, str]] = None,
+        max_table_rows: int = 20,
+        max_columns: int = 8,
+        max_cell_chars: int = 60,
+) -> Optional[str]:
+    """answer ``question`` from ``result`` without the LLM, as ``ANSWER_PROMPT`` would:
+    one row becomes a Chinese sentence, several rows a markdown table.
+
+    Columns are named by ``labels`` (see ``column_labels``). Returns None when the
+    result needs the LLM: the question asks for an interpretation, a row has a
+    column without a Chinese label, the result was truncated, or it is too wide,
+    too long or holds long text.
+
+    Examples:
+        >>> render_answer("有多少条投诉?", QueryResult(["COUNT(*)"], [(35,)], 1))
+        '查询结果为 35。'
+    """
+    if any(word in question for word in _REASONING_WORDS):
+        return None
+    if result.truncated or not result.columns or len(result.columns) > max_columns:
+        return None
+    if result.row_count > max_table_rows:
+        return None
+    if any(len(format_value(item)) > max_cell_chars for row in result.rows for item in row):
+        return None
+
+    if result.row_count == 0:
+        return "没有查询到符合条件的数据。"
+
+    if result.row_count == 1:
+        row = result.rows[0]
+        if len(row) == 1:
+            label = _label(result.columns[0], labels)
+            value = format_value(row[0])
+            return f"查询结果为 {value}。" if label is None else f"查询结果: {label}为 {value}。"
+        names = [_label(column, labels) for column in result.columns]
+        if any(name is None for name in names):
+            return None
+        parts = [f"{name}为 {format_value(item)}" for name, item in zip(names, row)]
+        return f"查询结果: {'，'.join(parts)}。"
+
+    headers = [_label(column, labels) or column for column in result.columns]
+    lines = [
+        "| " + " | ".join(header.replace("|", "\\|") for header in headers) + " |",
+        "| " + " | ".join("---" for _ in result.columns) + " |",
+    ]
+    lines.extend("| " + " | ".join(_cell(item) for item in row) + " |" for row in result.rows)
+    return "\n".join(lines)
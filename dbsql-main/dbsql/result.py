@@ -0,0 +1,224 @@
+"""SQL 查询结果"""
+from __future__ import annotations
+
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from dbsql import logger
+from dbsql.pool import ConnectionPool, PooledConnection
+
+
+@dataclass
+class QueryResult:
+    """structured, size-bounded result of a SQL query.
+
+    Attributes:
+        columns: column names of the result.
+        rows: the rows kept, with the driver's native python values.
+        row_count: number of rows kept in ``rows``.
+        truncated: True when more rows were available than the row or byte cap allowed.
+        truncated_by: ``"rows"`` or ``"bytes"``, the cap that was hit.
+        max_rows: the row cap that was applied.
+        max_bytes: the byte cap that was applied.
+        metadata: extra information about the execution.
+    """
+    columns: List[str]
+    rows: List[tuple]
+    row_count: int
+    truncated: bool = False
+    truncated_by: Optional[str] = None
+    max_rows: Optional[int] = None
+    max_bytes: Optional[int] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def collect(
+            cls,
+            columns: Sequence[str],
+            batches: Iterable[Sequence[tuple]],
+            max_rows: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+    ) -> QueryResult:
+        """keep rows from ``batches`` until ``max_rows`` rows or ``max_bytes`` bytes of
+        rendered cell text, and flag the result as truncated if more rows were left"""
+        rows = []
+        size = 0
+        truncated_by = None
+        for batch in batches:
+            for row in batch:
+                if max_rows is not None and len(rows) >= max_rows:
+                    truncated_by = "rows"
+                    break
+                row_size = sum(len(str(item).encode("utf-8")) for item in row)
+                if max_bytes is not None and size + row_size > max_bytes:
+                    truncated_by = "bytes"
+                    break
+                rows.append(tuple(row))
+                size += row_size
+            if truncated_by is not None:
+                break
+
+        return cls(
+            columns=list(columns),
+            rows=rows,
+            row_count=len(rows),
+            truncated=truncated_by is not None,
+            truncated_by=truncated_by,
+            max_rows=max_rows,
+            max_bytes=max_bytes,
+        )
+
+    def to_text(self, max_cell_chars: int = 200) -> str:
+        """render the result compactly for the LLM prompt"""
+        def cell(item: Any) -> str:
+            text = "NULL" if item is None else str(item).replace("\n", " ")
+            if len(text) > max_cell_chars:
+                text = text[:max_cell_chars] + "..."
+            return text
+
+        lines = [" | ".join(self.columns)]
+        lines.extend(" | ".join(cell(item) for item in row) for row in self.rows)
+        if self.truncated:
+            limit = f"{self.max_rows} rows" if self.truncated_by == "rows" else f"{self.max_bytes} bytes"
+            lines.append(f"({self.row_count} rows shown, result truncated at {limit})")
+        else:
+            lines.append(f"({self.row_count} rows)")
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "columns": self.columns,
+            "rows": [list(row) for row in self.rows],
+            "row_count": self.row_count,
+            "truncated": self.truncated,
+            "truncated_by": self.truncated_by,
+            "metadata": self.metadata,
+        }
+
+    def __str__(self) -> str:
+        return self.to_text()
+
+
+class RowStream:
+    """rows of a query streamed in ``fetchmany`` batches from a pooled connection.
+
+    The connection is borrowed when the stream is first used and given back to
+    the pool as soon as the rows are exhausted or ``close()`` is called, so large
+    results can be read in constant memory. A stream dropped without either
+    still gives its connection back when it is garbage collected.
+
+    Examples:
+        >>> with dmdb.stream('SELECT * FROM XYCS."EGOV_DISPATCH"', batch_size=1000) as rows:
+        ...     print(rows.columns)
+        ...     for row in rows:
+        ...         writer.writerow(row)
+    """
+
+    def __init__(
+            self,
+            pool: ConnectionPool,
+            command: str,
+            parameters: Optional[Any] = None,
+            batch_size: int = 500,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+
+        self.command = command
+        self.parameters = parameters
+        self.batch_size = batch_size
+        self._pool = pool
+        self._connection: Optional[PooledConnection] = None
+        self._cursor = None
+        self._columns: Optional[List[str]] = None
+        self._closed = False
+        self._cancelled = False
+        self._finalizer: Optional[weakref.finalize] = None
+
+    @property
+    def columns(self) -> List[str]:
+        """column names of the result; runs the statement, so close the stream
+        (or use it as a context manager) when its rows are not read"""
+        self._open()
+        return list(self._columns or [])
+
+    def batches(self) -> Iterator[Sequence[tuple]]:
+        """yield lists of at most ``batch_size`` rows"""
+        self._open()
+        try:
+            # statements without a result set (DML/DDL) have nothing to fetch
+            while not self._closed and self._cursor.description is not None:
+                rows = self._cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield rows
+        except Exception:
+            self._connection.suspect = True
+            raise
+        finally:
+            self.close()
+
+    def __iter__(self) -> Iterator[tuple]:
+        for rows in self.batches():
+            yield from rows
+
+    def cancel(self) -> None:
+        """interrupt the running statement, safe to call from another thread"""
+        self._cancelled = True
+        if self._connection is not None and not self._closed:
+            self._connection.cancel()
+
+    def close(self) -> None:
+        """stop streaming and give the connection back to the pool"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        if self._connection is not None:
+            _release(self._pool, self._connection, self._cursor)
+
+    def __enter__(self) -> RowStream:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _open(self) -> None:
+        if self._cursor is not None:
+            return
+        if self._closed:
+            raise RuntimeError("row stream is closed")
+
+        self._connection = self._pool.acquire()
+        try:
+            if self._cancelled:
+                raise RuntimeError("statement cancelled before it started")
+            cursor = self._connection.cursor()
+            if self.parameters is None:
+                cursor.execute(self.command)
+            else:
+                cursor.execute(self.command, self.parameters)
+        except BaseException:
+            self._connection.suspect = True
+            self._closed = True
+            self._pool.release(self._connection)
+            raise
+        self._cursor = cursor
+        self._finalizer = weakref.finalize(self, _release_abandoned, self._pool, self._connection, cursor)
+        self._columns = [column[0] for column in cursor.description or ()]
+
+
+def _release(pool: ConnectionPool, connection: PooledConnection, cursor) -> None:
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Exception:
+            connection.suspect = True
+    pool.release(connection)
+
+
+def _release_abandoned(pool: ConnectionPool, connection: PooledConnection, cursor) -> None:
+    logger.warning("row stream garbage collected before it was read or closed, release its connection")
+    _release(pool, connection, cursor)
@@ -0,0 +1,119 @@
+"""SQL 执行结果缓存 (按规范化 SQL 与数据版本号)"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Any, Dict, Optional, Tuple
+
+from dbsql.epoch import current_data_epoch
+from dbsql.metrics import record_cache
+from dbsql.result import QueryResult
+
+# quoted literals and identifiers are kept verbatim, everything else is case folded
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+_SPACES = re.compile(r"\s+")
+_READ_ONLY = ("select", "with", "show", "desc", "describe", "explain")
+
+
+def canonical_sql(sql: str) -> str:
+    """normalize whitespace and keyword / identifier case of ``sql``, so that
+    formatting differences of the same statement share one cache entry"""
+    parts = _QUOTED.split(sql.strip().rstrip(";").strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACES.sub(" ", parts[i]).lower()
+    return "".join(parts).strip()
+
+
+def _size(result: QueryResult) -> int:
+    return sum(len(str(item).encode("utf-8")) for row in result.rows for item in row)
+
+
+class ResultCache:
+    """LRU cache of read-only query results bounded by ``max_bytes`` of cell text.
+
+    Entries are keyed on the canonical SQL text, the row / byte caps and the
+    current data epoch (see ``dbsql.epoch``), so importing new data and bumping
+    the epoch makes every older entry unreachable.
+
+    Args:
+        ttl: seconds an entry stays valid, None to never expire.
+        max_bytes: total size of cached results, least recently used ones are evicted.
+
+    Examples:
+        >>> cache = ResultCache(ttl=300, max_bytes=16 * 1024 * 1024)
+        >>> db = DMDatabase(..., result_cache=cache)
+        >>> db.query("select count(*) from XYCS.CITY")
+        >>> db.query("SELECT COUNT(*)\\nFROM XYCS.CITY;").metadata["cached"]
+        True
+        >>> cache.stats()
+        {'hits': 1, 'misses': 1, 'entries': 1, 'bytes': 2, 'evictions': 0}
+    """
+
+    def __init__(self, ttl: Optional[float] = 300.0, max_bytes: int = 16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple, Tuple[float, int, QueryResult]] = OrderedDict()
+
+    @staticmethod
+    def key(command: str, max_rows: Optional[int], max_bytes: Optional[int]) -> Optional[Tuple]:
+        """cache key of ``command``, None for statements that may change data"""
+        sql = canonical_sql(command)
+        if not sql.startswith(_READ_ONLY):
+            return None
+        return sql, max_rows, max_bytes, current_data_epoch()
+
+    def get(self, key: Tuple) -> Optional[QueryResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                record_cache("result", hit=False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            result = entry[2]
+        record_cache("result", hit=True)
+        return replace(result, rows=list(result.rows), metadata={**result.metadata, "cached": True})
+
+    def set(self, key: Tuple, result: QueryResult) -> None:
+        size = _size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.time(), size, result)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "evictions": self.evictions,
+            }
+
+    def _pop(self, key: Tuple) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
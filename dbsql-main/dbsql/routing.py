@@ -0,0 +1,104 @@
+"""基于 BM25 (中文字符二元组) 的本地表路由"""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from dbsql import logger
+
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_WORD = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """character bigrams of Chinese runs plus lowercase ascii words"""
+    text = text.lower()
+    tokens = _WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def table_document(table: str, info: Dict) -> str:
+    """text a table is matched on: its name, 表用途 and the 表结构 column descriptions"""
+    parts = [table, info.get("表用途", "")]
+    for column, description in info.get("表结构", {}).items():
+        parts.append(f"{column} {description}")
+    return "\n".join(parts)
+
+
+class TableRouter:
+    """rank tables for a question with BM25 over the table descriptions of
+    ``table_info.json``, so that most questions need no LLM call to pick tables.
+
+    ``route`` only answers when it is confident: the best score must reach
+    ``min_score`` and tables scoring below ``relative_cutoff`` of the best one
+    are dropped. Otherwise it returns None and the caller falls back to the LLM.
+
+    Args:
+        table_info: ``{table: {"表用途": str, "表结构": {column: description}}}``.
+        min_score: lowest best-table score accepted as a confident match.
+        relative_cutoff: keep tables scoring at least this share of the best score.
+        k1: BM25 term frequency saturation.
+        b: BM25 document length normalization.
+
+    Examples:
+        >>> router = TableRouter(table_info)
+        >>> router.route("去年虚假宣传的投诉有多少?")
+        ['虚假宣传']
+    """
+
+    def __init__(
+            self,
+            table_info: Dict[str, Dict],
+            min_score: float = 2.0,
+            relative_cutoff: float = 0.6,
+            k1: float = 1.5,
+            b: float = 0.75,
+    ):
+        self.min_score = min_score
+        self.relative_cutoff = relative_cutoff
+        self.k1 = k1
+        self.b = b
+
+        self.tables = list(table_info.keys())
+        self._term_freqs = [Counter(tokenize(table_document(t, table_info[t]))) for t in self.tables]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+        doc_freqs = Counter()
+        for tf in self._term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(self.tables)
+        self._idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def rank(self, question: str) -> List[Tuple[str, float]]:
+        """every table with a positive score, best first"""
+        terms = [term for term in set(tokenize(question)) if term in self._idf]
+        scores = []
+        for table, tf, length in zip(self.tables, self._term_freqs, self._lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_length)
+            score = sum(
+                self._idf[term] * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+                for term in terms if term in tf
+            )
+            if score > 0:
+                scores.append((table, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores
+
+    def route(self, question: str, k: int = 3) -> Optional[List[str]]:
+        """the at most ``k`` tables relevant to ``question``, None when unsure"""
+        ranking = self.rank(question)
+        if not ranking or ranking[0][1] < self.min_score:
+            logger.info(f"table routing not confident for: {question}")
+            return None
+        best = ranking[0][1]
+        tables = [table for table, score in ranking[:k] if score >= self.relative_cutoff * best]
+        logger.info(f"table routing: {tables} (best score {best:.2f})")
+        return tables
@@ -0,0 +1,100 @@
+"""表结构元数据缓存 (DDL / 列名 / 示例数据)"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from dbsql import logger
+
+
+class SchemaCache:
+    """in-process cache of per-table schema metadata, optionally persisted to disk.
+
+    Entries are stored per table and per kind (e.g. ``ddl``, ``columns``,
+    ``sample_rows:3``) together with the time they were loaded, so that a
+    restart can reuse them until they expire.
+
+    Args:
+        ttl: seconds an entry stays valid, None to never expire.
+        path: json file used to persist the cache, None to keep it in memory only.
+
+    Examples:
+        >>> cache = SchemaCache(ttl=3600, path="schema_cache.json")
+        >>> cache.get_or_load("XYCS.CITY", "ddl", lambda: "CREATE TABLE ...")
+        'CREATE TABLE ...'
+        >>> cache.invalidate(["XYCS.CITY"])
+    """
+
+    def __init__(self, ttl: Optional[float] = 3600.0, path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Dict[str, Any]]] = dict()
+        if path is not None:
+            self._load()
+
+    def get(self, table: str, kind: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(table, {}).get(kind)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                del self._entries[table][kind]
+                return None
+            return entry["value"]
+
+    def set(self, table: str, kind: str, value: Any) -> None:
+        with self._lock:
+            self._entries.setdefault(table, dict())[kind] = {"value": value, "loaded_at": time.time()}
+            self._save()
+
+    def update(self, values: Dict[str, Dict[str, Any]]) -> None:
+        """set many entries at once, ``values`` maps table -> kind -> value"""
+        now = time.time()
+        with self._lock:
+            for table, kinds in values.items():
+                entries = self._entries.setdefault(table, dict())
+                for kind, value in kinds.items():
+                    entries[kind] = {"value": value, "loaded_at": now}
+            self._save()
+
+    def get_or_load(self, table: str, kind: str, loader: Callable[[], Any]) -> Any:
+        value = self.get(table, kind)
+        if value is None:
+            value = loader()
+            self.set(table, kind, value)
+        return value
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> None:
+        """drop cached entries of ``tables``, or of every table when None"""
+        with self._lock:
+            if tables is None:
+                self._entries.clear()
+            else:
+                for table in tables:
+                    self._entries.pop(table, None)
+            self._save()
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry["loaded_at"] > self.ttl
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as error:
+            logger.warning(f"ignore unreadable schema cache {self.path}: {error}")
+            self._entries = dict()
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
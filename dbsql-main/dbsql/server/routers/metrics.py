@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from dbsql.metrics import CONTENT_TYPE, REGISTRY
+
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus 格式的运行指标 (各阶段耗时、问答结果、缓存命中、token 用量)"""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
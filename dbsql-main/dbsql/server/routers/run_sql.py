@@ -1,9 +1,11 @@
 from loguru import logger
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 
 from dbsql.server.models.input import FastGPTRequest
 from dbsql.server.models.output import ApiResponse
-from dbsql.llm.chains.sql_answer import chain_run
+from dbsql.llm.chains.sql_answer import astep_stream, chain_run
+from dbsql.server.sse import sse_response
 
 
 router = APIRouter()
@@ -22,10 +24,30 @@ async def run_sql(request: FastGPTRequest):
         )
     
     logger.info(f"输入问题：{question}")
-    answer = chain_run(question)
+    # chain_run blocks on the LLM and the database, keep it off the event loop
+    answer = await run_in_threadpool(chain_run, question)
     logger.info(f"最终回复：{answer}")
     response = ApiResponse(
         # 适配FastGPT引用格式
         data_list=[{"q": question, "a": answer}]
     )
     return response
+
+
+@router.post("/sql/run/stream")
+async def run_sql_stream(request: FastGPTRequest):
+    """执行 SQL 生成答案接口 (Server-Sent Events, 每个阶段完成即推送)"""
+    logger.debug(f"FastGPTRequest: {request}")
+    question = request.data.get("q", None)
+
+    async def stages():
+        if not question:
+            yield {"stage": "error", "data": {"message": "未发现question字段，或内容为空。"}}
+            return
+        yield {"stage": "question", "data": question}
+        async for stage in astep_stream(question):
+            if stage["stage"] == "done":
+                logger.info(f"最终回复：{stage['data']['answer']}")
+            yield stage
+
+    return sse_response(stages())
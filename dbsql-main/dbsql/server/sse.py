@@ -0,0 +1,29 @@
+"""Server-Sent Events 输出工具"""
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(event: str, data: Any) -> str:
+    """format one server-sent event with a json payload"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _sse_stream(stages: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    try:
+        async for stage in stages:
+            yield sse_event(stage["stage"], stage["data"])
+    except Exception as e:
+        yield sse_event("error", {"message": f"处理失败: {str(e)}"})
+
+
+def sse_response(stages: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """stream ``{"stage": ..., "data": ...}`` items as server-sent events"""
+    return StreamingResponse(
+        _sse_stream(stages),
+        media_type="text/event-stream",
+        # keep reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
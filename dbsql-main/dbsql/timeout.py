@@ -0,0 +1,93 @@
+"""SQL 语句超时与取消"""
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from dbsql import logger
+
+
+class QueryTimeout(RuntimeError):
+    """raised when a statement was cancelled because it ran past its timeout"""
+
+
+class StatementTimer:
+    """watchdog cancelling a running statement once ``timeout`` seconds elapse.
+
+    ``cancel`` is called from a timer thread and must interrupt the statement
+    (e.g. ``connection.cancel()`` or ``KILL QUERY``). An error raised inside the
+    ``with`` block after the timer fired is re-raised as QueryTimeout.
+
+    Examples:
+        >>> with StatementTimer(30, connection.cancel):
+        ...     cursor.execute(sql)
+        ...     rows = cursor.fetchall()
+    """
+
+    def __init__(self, timeout: Optional[float], cancel: Callable[[], None]):
+        self.timeout = timeout
+        self._cancel = cancel
+        self._timer: Optional[threading.Timer] = None
+        self.fired = False
+
+    def __enter__(self) -> StatementTimer:
+        if self.timeout is not None and self.timeout > 0:
+            self._timer = threading.Timer(self.timeout, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.fired and exc_type is not None and issubclass(exc_type, Exception):
+            raise QueryTimeout(f"statement cancelled after {self.timeout}s timeout") from exc
+
+    def _fire(self) -> None:
+        self.fired = True
+        try:
+            self._cancel()
+        except Exception as error:
+            logger.warning(f"failed to cancel statement after timeout: {error}")
+
+
+class CancelToken:
+    """lets another thread cancel the statement a query is running.
+
+    The database binds its cancel callback while the statement runs; a token
+    cancelled before that cancels the statement as soon as it is bound.
+
+    Examples:
+        >>> token = CancelToken()
+        >>> threading.Thread(target=db.query, args=(sql,), kwargs={"cancel_token": token}).start()
+        >>> token.cancel()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel: Optional[Callable[[], None]] = None
+        self.cancelled = False
+
+    @contextmanager
+    def bind(self, cancel: Callable[[], None]) -> Iterator[None]:
+        with self._lock:
+            self._cancel = cancel
+            cancelled = self.cancelled
+        if cancelled:
+            cancel()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._cancel = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            cancel = self._cancel
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception as error:
+                logger.warning(f"failed to cancel statement: {error}")
@@ -1,9 +1,11 @@
 import re
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional
 
 from langchain_core.messages import AIMessage
 
 from .dmdb.dm_database import DMDatabase
+from .profile import ProfileStore
 
 
 def sql_extract(sentence: str) -> List[str]:
@@ -35,18 +37,93 @@ def table_extract(message: AIMessage) -> Optional[List[str]]:
             result.append(table)
         return result
 
-def table_info_generate(db: DMDatabase, table_names: List[str], extra_data: Dict[str, Dict]) -> str:
-    print("call")
-    if table_names is None or len(table_names) == 0:
-        table_names = db.get_usable_table_names()
-    table_info = ""
-    for table_name in table_names:
-        table_info += f"######### {table_name} #########\n"
+def table_fragment(
+        db: DMDatabase,
+        table_name: str,
+        extra_data: Dict[str, Dict],
+        profiles: Optional[ProfileStore] = None,
+) -> str:
+    """prompt text describing one table"""
+    table_info = f"######### {table_name} #########\n"
+    if profiles is not None and table_name in profiles:
+        # offline column statistics replace the live sample rows query
+        table_info += f"1. SQL描述与列统计\n"
+        table_info += db.get_table_ddl(table_name).strip()
+        table_info += "\n\n"
+        table_info += profiles.render(table_name)
+    else:
         table_info += f"1. SQL描述与示例数据\n"
         table_info += db.get_table_info([table_name]).strip()
-        table_info += "\n\n2. 表用途\n"
-        table_info += extra_data[table_name]["表用途"]
-        table_info += "\n\n3. 表结构\n"
-        for id, state in extra_data[table_name]["表结构"].items():
-            table_info += f"- {id}: {state}\n"
+    table_info += "\n\n2. 表用途\n"
+    table_info += extra_data[table_name]["表用途"]
+    table_info += "\n\n3. 表结构\n"
+    for id, state in extra_data[table_name]["表结构"].items():
+        table_info += f"- {id}: {state}\n"
     return table_info
+
+
+def table_info_generate(
+        db: DMDatabase,
+        table_names: List[str],
+        extra_data: Dict[str, Dict],
+        profiles: Optional[ProfileStore] = None,
+) -> str:
+    print("call")
+    if table_names is None or len(table_names) == 0:
+        table_names = db.get_usable_table_names()
+    return "".join(table_fragment(db, table_name, extra_data, profiles) for table_name in table_names)
+
+
+class TableInfoFragments:
+    """per-table prompt fragments built once, so that a prompt is assembled by
+    joining cached strings instead of querying the database for every question.
+
+    The fragments are held in a read-only mapping that ``refresh`` swaps as a
+    whole, so readers never see a partially rebuilt set.
+
+    Examples:
+        >>> fragments = TableInfoFragments(db, extra_data)
+        >>> table_info = fragments.render(["虚假宣传", "产品质量"])
+        >>> fragments.refresh(["虚假宣传"])  # after the table changed
+    """
+
+    def __init__(
+            self,
+            db: DMDatabase,
+            extra_data: Dict[str, Dict],
+            profiles: Optional[ProfileStore] = None,
+    ):
+        self.db = db
+        self.extra_data = extra_data
+        self.profiles = profiles
+        self._fragments: Mapping[str, str] = MappingProxyType(dict())
+        self.refresh()
+
+    def refresh(self, table_names: Optional[Iterable[str]] = None) -> None:
+        """rebuild the fragments of ``table_names``, or of every usable table when None"""
+        if table_names is None:
+            fragments = dict()
+            table_names = self.db.get_usable_table_names()
+        else:
+            fragments = dict(self._fragments)
+        table_names = list(table_names)
+        if hasattr(self.db, "preload_schema"):
+            # one catalog round trip for all tables instead of one per table
+            self.db.preload_schema(table_names)
+        for table_name in table_names:
+            fragments[table_name] = table_fragment(self.db, table_name, self.extra_data, self.profiles)
+        self._fragments = MappingProxyType(fragments)
+
+    def render(self, table_names: Optional[List[str]] = None) -> str:
+        """the table info of ``table_names``, of every table when empty"""
+        return "".join(self.pieces(table_names))
+
+    def pieces(self, table_names: Optional[List[str]] = None) -> List[str]:
+        """the fragments of ``table_names``, of every table when empty"""
+        if table_names is None or len(table_names) == 0:
+            return list(self._fragments.values())
+        missing = [table_name for table_name in table_names if table_name not in self._fragments]
+        if missing:
+            self.refresh(missing)
+        fragments = self._fragments
+        return [fragments[table_name] for table_name in table_names]
@@ -0,0 +1,227 @@
+"""执行前的 SQL 校验 (表名 / 列名与缓存的表结构比对)"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from dbsql import logger
+
+_TABLE_KEYWORDS = {"FROM", "JOIN", "INTO", "UPDATE", "TABLE"}
+_READ_STATEMENTS = {"SELECT"}
+
+
+def _unquote(name: str) -> str:
+    if len(name) >= 2 and name[0] == name[-1] and name[0] in "`\"":
+        name = name[1:-1]
+    elif len(name) >= 2 and name[0] == "[" and name[-1] == "]":
+        name = name[1:-1]
+    return name.lower()
+
+
+def _is_name(token, quoted_names: bool = True) -> bool:
+    if token.ttype in T.Literal.String.Symbol:
+        # "x" is an identifier for DaMeng but a string literal for MySQL
+        return quoted_names
+    # builtins are type names and words like INTERVAL
+    return token.ttype in T.Name and token.ttype not in T.Name.Builtin
+
+
+def _is_keyword(token, *values: str) -> bool:
+    if token.ttype not in T.Keyword:
+        return False
+    return not values or token.normalized in values
+
+
+class SchemaValidator:
+    """check the tables and columns a generated query uses against the known schema
+    before it is sent to the database.
+
+    The check is conservative: unqualified columns are only checked when every
+    table of the query is known, and anything it cannot resolve (subqueries, CTEs,
+    select-list aliases) is accepted, so a rejected query is wrong with high
+    confidence.
+
+    Args:
+        columns: ``{table: [column, ...]}`` of every usable table.
+        dialect: ``"mysql"`` reads double quotes as string literals, others as identifiers.
+
+    Examples:
+        >>> validator = SchemaValidator({"虚假宣传": ["id", "time", "amount"]})
+        >>> validator.validate("SELECT MAX(price) FROM 虚假宣传")
+        ['unknown column price']
+    """
+
+    def __init__(self, columns: Dict[str, Iterable[str]], dialect: str = "dameng"):
+        self.quoted_names = dialect != "mysql"
+        self._table_names = {_unquote(table): table for table in columns}
+        self.columns: Dict[str, Set[str]] = {
+            _unquote(table): {_unquote(column) for column in table_columns}
+            for table, table_columns in columns.items()
+        }
+
+    @classmethod
+    def from_db(cls, db, tables: Optional[Iterable[str]] = None) -> SchemaValidator:
+        tables = db.get_usable_table_names() if tables is None else tables
+        return cls({table: db.get_table_columns(table) for table in tables}, dialect=db.dialect)
+
+    def validate(self, sql: str) -> List[str]:
+        """problems found in ``sql``, empty when it looks valid"""
+        statements = [statement for statement in sqlparse.parse(sql) if statement.token_first() is not None]
+        if not statements:
+            return ["empty statement"]
+        errors = []
+        for statement in statements:
+            if statement.get_type() not in _READ_STATEMENTS:
+                errors.append(f"only SELECT statements are allowed, got {statement.get_type()}")
+                continue
+            errors.extend(self._check(statement))
+        return errors
+
+    def referenced_tables(self, sql: str) -> List[str]:
+        """known tables the query refers to, with their original spelling"""
+        tables = []
+        for statement in sqlparse.parse(sql):
+            for table in self._scan(statement)[0].values():
+                if table in self.columns and self._table_names[table] not in tables:
+                    tables.append(self._table_names[table])
+        return tables
+
+    def _check(self, statement) -> List[str]:
+        aliases, derived, names, qualified = self._scan(statement)
+        errors = []
+        for table in sorted(set(aliases.values()) - derived):
+            if table not in self.columns:
+                errors.append(f"unknown table {table}")
+
+        known = {alias: table for alias, table in aliases.items() if table in self.columns}
+        for qualifier, column in qualified:
+            table = known.get(qualifier)
+            if table is not None and column != "*" and column not in self.columns[table]:
+                errors.append(f"unknown column {column} in table {table}")
+
+        # unqualified names can only be checked when every table of the query is known
+        if errors or derived or set(aliases.values()) - set(self.columns):
+            return errors
+        available = set().union(*(self.columns[table] for table in aliases.values())) if aliases else set()
+        for column in names:
+            if column not in available:
+                errors.append(f"unknown column {column}")
+        return errors
+
+    def _scan(self, statement) -> Tuple[Dict[str, str], Set[str], List[str], List[Tuple[str, str]]]:
+        """walk the flattened tokens and collect
+
+        - ``aliases``: alias or table name -> table name of every table reference
+        - ``derived``: names of subqueries and CTEs, whose columns are unknown
+        - ``names``: unqualified column names
+        - ``qualified``: ``(qualifier, column)`` pairs
+        """
+        leaves = [token for token in statement.flatten() if not token.is_whitespace and token.ttype not in T.Comment]
+        aliases: Dict[str, str] = dict()
+        derived: Set[str] = set()
+        select_aliases: Set[str] = set()
+        names: List[str] = []
+        qualified: List[Tuple[str, str]] = []
+
+        # parenthesis depth -> whether the tokens at that depth are in a table list
+        in_tables = {0: False}
+        # parenthesis depth -> whether the parenthesis holds the arguments of a function call
+        in_function = {0: False}
+        subquery_closed = False
+        depth = 0
+        i = 0
+        while i < len(leaves):
+            token = leaves[i]
+            prev = leaves[i - 1] if i > 0 else None
+            following = leaves[i + 1] if i + 1 < len(leaves) else None
+
+            if token.match(T.Punctuation, "("):
+                depth += 1
+                in_tables[depth] = False
+                in_function[depth] = prev is not None and self._name(prev)
+            elif token.match(T.Punctuation, ")"):
+                in_tables.pop(depth, None)
+                in_function.pop(depth, None)
+                depth = max(depth - 1, 0)
+                subquery_closed = in_tables.get(depth, False)
+            elif _is_keyword(token, "AS") and following is not None and following.match(T.Punctuation, "("):
+                # WITH name AS (...): the CTE name was recorded as a column, move it
+                if prev is not None and self._name(prev) and names and names[-1] == _unquote(prev.value):
+                    names.pop()
+                    derived.add(_unquote(prev.value))
+            elif _is_keyword(token, "AS"):
+                pass
+            elif token.ttype in T.Keyword or token.ttype in T.DML or token.ttype in T.CTE:
+                if token.ttype in T.DML:
+                    in_function[depth] = False  # a subquery as the argument
+                # the FROM of EXTRACT(YEAR FROM x) or TRIM(LEADING 'a' FROM x) reads a value, not a table
+                in_tables[depth] = not in_function[depth] \
+                    and any(word in _TABLE_KEYWORDS for word in token.normalized.split())
+                if not in_tables[depth]:
+                    subquery_closed = False
+            elif token.match(T.Punctuation, ","):
+                subquery_closed = False
+            elif self._name(token):
+                name = _unquote(token.value)
+                if following is not None and following.match(T.Punctuation, "("):
+                    pass  # function call
+                elif following is not None and following.match(T.Punctuation, "."):
+                    pass  # qualifier, handled with the qualified name
+                elif prev is not None and prev.match(T.Punctuation, "."):
+                    qualifier = _unquote(leaves[i - 2].value) if i >= 2 else ""
+                    if in_tables[depth]:
+                        aliases[name] = name
+                        self._read_alias(leaves, i, aliases, name)
+                    else:
+                        qualified.append((qualifier, name))
+                elif in_tables[depth]:
+                    if subquery_closed:
+                        derived.add(name)
+                        subquery_closed = False
+                    elif not self._is_alias(prev):
+                        aliases[name] = name
+                        self._read_alias(leaves, i, aliases, name)
+                elif self._is_alias(prev):
+                    select_aliases.add(name)
+                else:
+                    names.append(name)
+            i += 1
+
+        for alias in list(aliases):
+            if alias in derived:
+                del aliases[alias]
+        names = [name for name in names if name not in select_aliases and name not in derived and name not in aliases]
+        qualified = [(q, c) for q, c in qualified if q not in derived]
+        return aliases, derived, names, qualified
+
+    def _name(self, token) -> bool:
+        return _is_name(token, self.quoted_names)
+
+    def _is_alias(self, prev) -> bool:
+        """a name directly after another operand (or AS) is an alias"""
+        if prev is None:
+            return False
+        if _is_keyword(prev, "AS"):
+            return True
+        return self._name(prev) or prev.match(T.Punctuation, ")") or prev.ttype in T.Literal \
+            or prev.match(T.Wildcard, "*")
+
+    def _read_alias(self, leaves, i: int, aliases: Dict[str, str], table: str) -> None:
+        j = i + 1
+        if j < len(leaves) and _is_keyword(leaves[j], "AS"):
+            j += 1
+        if j < len(leaves) and self._name(leaves[j]):
+            aliases[_unquote(leaves[j].value)] = table
+
+
+def validate_or_log(validator: Optional[SchemaValidator], sql: str) -> List[str]:
+    """``validator.validate`` that never raises, a validator bug must not block a query"""
+    if validator is None:
+        return []
+    try:
+        return validator.validate(sql)
+    except Exception as error:
+        logger.warning(f"skip SQL validation: {error}")
+        return []
@@ -0,0 +1,42 @@
+from dbsql.memory import QueryMemory
+
+
+def make_memory(*questions):
+    memory = QueryMemory()
+    for question in questions:
+        memory.add(question, f"SELECT '{question}'")
+    return memory
+
+
+def test_match_ignores_fillers_and_punctuation():
+    memory = make_memory("去年的投诉有多少?")
+    entry = memory.match("请问去年投诉有多少")
+    assert entry is not None
+    assert entry["question"] == "去年的投诉有多少?"
+
+
+def test_match_rejects_swapped_years():
+    memory = make_memory("2023年虚假宣传投诉比2022年多多少条")
+    assert memory.match("2022年虚假宣传投诉比2023年多多少条") is None
+
+
+def test_match_rejects_reordered_digits():
+    memory = make_memory("2012年虚假宣传投诉有多少条", "2011年虚假宣传投诉有多少条")
+    assert memory.match("2021年虚假宣传投诉有多少条") is None
+
+
+def test_match_rejects_different_words():
+    memory = make_memory("去年的投诉有多少")
+    assert memory.match("今年的投诉有多少") is None
+
+
+def test_examples_still_include_similar_questions():
+    memory = make_memory("2012年虚假宣传投诉有多少条")
+    examples = memory.examples("2021年虚假宣传投诉有多少条")
+    assert "2012年虚假宣传投诉有多少条" in examples
+
+
+def test_persisted_pairs_are_matched_after_reload(tmp_path):
+    path = str(tmp_path / "query_memory.json")
+    QueryMemory(path).add("去年的投诉有多少?", "SELECT 1")
+    assert QueryMemory(path).match("去年投诉有多少")["sql"] == "SELECT 1"
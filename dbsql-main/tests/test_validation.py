@@ -0,0 +1,55 @@
+import pytest
+
+from dbsql.validation import SchemaValidator
+
+
+@pytest.fixture
+def validator():
+    return SchemaValidator({
+        "EGOV_DISPATCH": ["ID", "CREATE_TIME", "TITLE", "AMOUNT"],
+        "EGOV_REGION": ["ID", "NAME"],
+    })
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT EXTRACT(YEAR FROM CREATE_TIME) FROM EGOV_DISPATCH",
+    "SELECT EXTRACT(YEAR FROM d.CREATE_TIME), COUNT(*) FROM EGOV_DISPATCH d GROUP BY EXTRACT(YEAR FROM d.CREATE_TIME)",
+    "SELECT SUBSTRING(TITLE FROM 2 FOR 3) FROM EGOV_DISPATCH",
+    "SELECT TRIM(LEADING 'a' FROM TITLE) FROM EGOV_DISPATCH",
+    "SELECT COUNT(*) FROM EGOV_DISPATCH WHERE EXTRACT(MONTH FROM CREATE_TIME) = 3",
+])
+def test_from_inside_function_is_not_a_table(validator, sql):
+    assert validator.validate(sql) == []
+
+
+def test_unknown_column_inside_function(validator):
+    sql = "SELECT EXTRACT(YEAR FROM UPDATE_TIME) FROM EGOV_DISPATCH"
+    assert validator.validate(sql) == ["unknown column update_time"]
+
+
+def test_subquery_inside_function_is_checked(validator):
+    sql = "SELECT COALESCE((SELECT MAX(AMOUNT) FROM EGOV_MISSING), 0) FROM EGOV_DISPATCH"
+    assert validator.validate(sql) == ["unknown table egov_missing"]
+
+
+def test_unknown_table(validator):
+    assert validator.validate("SELECT COUNT(*) FROM 虚假宣传") == ["unknown table 虚假宣传"]
+
+
+def test_unknown_qualified_column(validator):
+    sql = "SELECT d.PRICE FROM EGOV_DISPATCH d JOIN EGOV_REGION r ON d.ID = r.ID"
+    assert validator.validate(sql) == ["unknown column price in table egov_dispatch"]
+
+
+def test_in_subquery(validator):
+    sql = "SELECT TITLE FROM EGOV_DISPATCH WHERE ID IN (SELECT ID FROM EGOV_REGION WHERE NAME = '北京')"
+    assert validator.validate(sql) == []
+
+
+def test_only_select_is_allowed(validator):
+    assert validator.validate("DELETE FROM EGOV_DISPATCH") == ["only SELECT statements are allowed, got DELETE"]
+
+
+def test_referenced_tables_keep_their_spelling(validator):
+    sql = "SELECT EXTRACT(YEAR FROM CREATE_TIME) FROM egov_dispatch JOIN EGOV_REGION ON 1 = 1"
+    assert validator.referenced_tables(sql) == ["EGOV_DISPATCH", "EGOV_REGION"]
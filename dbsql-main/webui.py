@@ -6,8 +6,16 @@ import schedule # 用于定时任务
 import requests # 用于直接调用Ollama HTTP API
 import json     # 用于构造和解析JSON
 from collections import defaultdict # 用于聚合数据
+import threading
 import mysql.connector
+from mysql.connector import pooling
 from mysql.connector import Error as MySQLError # 为清晰起见，重命名Error
+from mysql.connector.errors import PoolError
+
+try:
+    from dbsql.llm.gateway import get_gateway # 共享的大模型调用网关 (连接复用/并发限制/重试预算)
+except ImportError:
+    get_gateway = None
 
 # --- 1. 从你的项目中导入DBSQLAnswer ---
 try:
@@ -36,6 +44,8 @@ DB_CONNECTION_CONFIG = {
 }
 MAIN_DB_NAME = 'NLP_DB_BY_TYPE'
 TABLE_NAME_PREFIX = ''
+DB_POOL_SIZE = 5             # 每个数据库的连接池大小
+TABLE_NAMES_CACHE_TTL = 300  # 表名列表缓存时间 (秒)
 
 EXPLICIT_COLUMN_SCHEMAS = {
     "id": {"type": "INT AUTO_INCREMENT PRIMARY KEY", "comment": '自动递增主键'},
@@ -72,25 +82,83 @@ else:
 SCHEDULED_ANALYSIS_TIME = "02:00"
 
 # --- 3. 数据库辅助函数 ---
+_db_pools = {}  # database_name -> MySQLConnectionPool
+_db_pools_lock = threading.Lock()
+
+def _get_db_pool(database_name=None):
+    key = database_name or ''
+    with _db_pools_lock:
+        if key not in _db_pools:
+            config = DB_CONNECTION_CONFIG.copy()
+            if database_name: config['database'] = database_name
+            _db_pools[key] = pooling.MySQLConnectionPool(
+                pool_name=f"webui_{key or 'server'}", pool_size=DB_POOL_SIZE, pool_reset_session=True, **config)
+        return _db_pools[key]
+
 def connect_db(database_name=None):
-    conn = None; config = DB_CONNECTION_CONFIG.copy()
-    if database_name: config['database'] = database_name
-    try: conn = mysql.connector.connect(**config)
+    """从共享连接池借出连接，conn.close() 会把连接归还给连接池"""
+    conn = None
+    try: conn = _get_db_pool(database_name).get_connection()
+    except PoolError:
+        # 连接池已借空时退回为独立连接
+        config = DB_CONNECTION_CONFIG.copy()
+        if database_name: config['database'] = database_name
+        try: conn = mysql.connector.connect(**config)
+        except MySQLError as e: print(f"错误：连接MySQL数据库 '{database_name if database_name else '服务器'}' 失败: {e}")
     except MySQLError as e: print(f"错误：连接MySQL数据库 '{database_name if database_name else '服务器'}' 失败: {e}")
     return conn
 
-def get_all_complaint_table_names(db_conn, prefix):
-    if not db_conn or not db_conn.is_connected(): return []
-    names = []; cursor = None
+def release_db(conn):
+    """归还 (或关闭) connect_db 得到的连接"""
+    if not conn: return
+    try: conn.close()
+    except MySQLError as e: print(f"警告：归还数据库连接时出错: {e}")
+
+_table_names_cache = {}  # database_name -> (加载时间, 表名列表)
+_table_names_lock = threading.Lock()
+_table_names_loading = {}  # database_name -> Lock, 同一数据库同时只有一次 SHOW TABLES
+
+def invalidate_table_names_cache(database_name=None):
+    """忘记缓存的表名列表; 导入数据 (新增月度表) 后由刷新按钮调用, 其余情况按 TABLE_NAMES_CACHE_TTL 过期"""
+    with _table_names_lock:
+        if database_name is None: _table_names_cache.clear()
+        else: _table_names_cache.pop(database_name, None)
+
+def _cached_table_names(database_name):
+    with _table_names_lock:
+        cached = _table_names_cache.get(database_name)
+    if cached and time.time() - cached[0] < TABLE_NAMES_CACHE_TTL:
+        return cached[1]
+    return None
+
+def get_all_complaint_table_names(db_conn, prefix, database_name=MAIN_DB_NAME):
+    """database_name 为 db_conn 所连的库 (connect_db 的参数); 缓存命中时不访问连接"""
+    all_names = _cached_table_names(database_name)
+    if all_names is None:
+        with _table_names_lock:
+            loading = _table_names_loading.setdefault(database_name, threading.Lock())
+        # 并发的未命中只由第一个调用者查询, 其余等待其结果
+        with loading:
+            all_names = _cached_table_names(database_name)
+            if all_names is None:
+                all_names = _load_table_names(db_conn)
+                if all_names is None: return []
+                with _table_names_lock:
+                    _table_names_cache[database_name] = (time.time(), all_names)
+    return [name for name in all_names if name.startswith(prefix)]
+
+def _load_table_names(db_conn):
+    if not db_conn or not db_conn.is_connected(): return None
+    cursor = None
     try:
         cursor = db_conn.cursor()
         cursor.execute("SHOW TABLES;")
-        for row in cursor.fetchall():
-            if row[0].startswith(prefix): names.append(row[0])
-    except MySQLError as e: print(f"错误：获取表名列表时出错: {e}")
+        return [row[0] for row in cursor.fetchall()]
+    except MySQLError as e:
+        print(f"错误：获取表名列表时出错: {e}")
+        return None
     finally: 
         if cursor: cursor.close()
-    return names
 
 # --- 4. 数据获取函数 (真实数据 for Page 1 & Alerts) ---
 def fetch_complaint_volume_data_from_db():
@@ -98,7 +166,7 @@ def fetch_complaint_volume_data_from_db():
     conn = connect_db(MAIN_DB_NAME)
     if not conn: return pd.DataFrame({'月份': [], '每月投诉量': []})
 
-    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX)
+    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX, MAIN_DB_NAME)
     daily_counts_aggregated = defaultdict(int)
 
     start_dt = pd.to_datetime("2023-01-01", utc=False)
@@ -121,7 +189,7 @@ def fetch_complaint_volume_data_from_db():
             except MySQLError as e: print(f"错误：从表 '{table_name}' 查询每日投诉量时出错: {e}")
             finally:
                 if cursor: cursor.close()
-    if conn.is_connected(): conn.close()
+    release_db(conn)
 
     if not daily_counts_aggregated: return pd.DataFrame({'月份': [], '每月投诉量': []})
 
@@ -149,7 +217,7 @@ def fetch_complaint_types_trend_from_db():
     conn = connect_db(MAIN_DB_NAME)
     if not conn: return pd.DataFrame({'月份': [], '投诉类型': [], '数量': []})
 
-    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX)
+    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX, MAIN_DB_NAME)
     all_type_trends_daily = []
 
     start_dt = pd.to_datetime("2023-01-01", utc=False)
@@ -173,7 +241,7 @@ def fetch_complaint_types_trend_from_db():
             except MySQLError as e: print(f"错误：从表 '{table_name}' 查询类型趋势时出错: {e}")
             finally:
                 if cursor: cursor.close()
-    if conn.is_connected(): conn.close()
+    release_db(conn)
 
     if not all_type_trends_daily: return pd.DataFrame({'月份': [], '投诉类型': [], '数量': []})
 
@@ -211,7 +279,7 @@ def get_overall_n_newest_complaints(n_records=50):
     db_main_conn = connect_db(database_name=MAIN_DB_NAME)
     if not db_main_conn: return []
     all_complaints_ever_list = []
-    complaint_table_names = get_all_complaint_table_names(db_main_conn, TABLE_NAME_PREFIX)
+    complaint_table_names = get_all_complaint_table_names(db_main_conn, TABLE_NAME_PREFIX, MAIN_DB_NAME)
     if not complaint_table_names:
         print(f"信息：在数据库 '{MAIN_DB_NAME}' 中没有找到以 '{TABLE_NAME_PREFIX}' 开头的表 (获取最新N条)。")
     else:
@@ -235,7 +303,7 @@ def get_overall_n_newest_complaints(n_records=50):
             except MySQLError as e: print(f"错误：从表 '{table_name}' 获取所有数据时出错: {e}")
             finally: 
                 if cursor: cursor.close()
-    if db_main_conn.is_connected(): db_main_conn.close()
+    release_db(db_main_conn)
     if not all_complaints_ever_list:
         print("信息：未能从任何表中获取到用于全局排序的数据。")
         return []
@@ -252,7 +320,7 @@ def fetch_complaint_types_distribution_from_db():
     print("数据库操作：正在获取各投诉类型分布...")
     conn = connect_db(MAIN_DB_NAME)
     if not conn: return pd.DataFrame({'投诉类型': [], '数量': []})
-    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX)
+    all_table_names = get_all_complaint_table_names(conn, TABLE_NAME_PREFIX, MAIN_DB_NAME)
     type_counts = []
     if all_table_names:
         for table_name in all_table_names:
@@ -268,7 +336,7 @@ def fetch_complaint_types_distribution_from_db():
             except MySQLError as e: print(f"错误：从表 '{table_name}' 查询总数时出错: {e}")
             finally: 
                 if cursor: cursor.close()
-    if conn.is_connected(): conn.close()
+    release_db(conn)
     df = pd.DataFrame(type_counts)
     print(f"数据库操作：成功获取了 {len(df)} 个投诉类型的分布数据。")
     return df
@@ -326,13 +394,16 @@ def analyze_complaint_trends_with_ollama_via_requests(
     api_endpoint = f"{base_url.rstrip('/')}/api/chat"
     analysis_report = f"未能连接到Ollama服务或API调用失败: {api_endpoint}"
     try:
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(api_endpoint, data=json.dumps(payload), headers=headers, timeout=300)
-        response.raise_for_status()
-        response_data = response.json()
-        if response_data and 'message' in response_data and 'content' in response_data['message']:
-            analysis_report = response_data['message']['content'].strip()
-        else: print(f"Ollama响应结构异常: {response_data}")
+        if get_gateway is not None:
+            analysis_report = get_gateway().ollama_chat(base_url, ollama_model_name, payload["messages"], timeout=300) or analysis_report
+        else:
+            headers = {"Content-Type": "application/json"}
+            response = requests.post(api_endpoint, data=json.dumps(payload), headers=headers, timeout=300)
+            response.raise_for_status()
+            response_data = response.json()
+            if response_data and 'message' in response_data and 'content' in response_data['message']:
+                analysis_report = response_data['message']['content'].strip()
+            else: print(f"Ollama响应结构异常: {response_data}")
     except requests.exceptions.Timeout: analysis_report = f"LLM分析请求超时(URL:{api_endpoint})"; print(analysis_report)
     except requests.exceptions.HTTPError as e: analysis_report = f"Ollama API HTTP错误(状态码 {e.response.status_code}): {e.response.text[:200]}"; print(analysis_report + e.response.text)
     except requests.exceptions.RequestException as e: analysis_report = f"无法连接到Ollama: {e}"; print(analysis_report)
@@ -452,7 +523,10 @@ with gr.Blocks(title="12315消费投诉智能分析平台", theme=gr.themes.Defa
                 type_histogram_output = gr.BarPlot(show_label=False, scale=1)
                 type_line_plot_output = gr.LinePlot(show_label=False, scale=1)
             
+            # 手动刷新时重新读取表名, 不必等缓存过期即可看到新导入的表; 并发的图表只会查询一次表名
             alert_refresh_button.click(
+                fn=invalidate_table_names_cache, inputs=None, outputs=None
+            ).then(
                 fn=generate_and_display_alerts_gradio, 
                 inputs=[], 
                 outputs=[daily_alert_display, alert_status_textbox]
@@ -460,6 +534,9 @@ with gr.Blocks(title="12315消费投诉智能分析平台", theme=gr.themes.Defa
             
             # 绘图按钮的事件，不再需要日期输入
             plot_actions = plot_refresh_button.click(
+                fn=invalidate_table_names_cache, inputs=None, outputs=None
+            )
+            plot_actions.then(
                 fn=update_volume_plot_gradio_monthly, 
                 inputs=None, # 移除了 date_picker_inputs
                 outputs=[volume_plot_output]
@@ -6,6 +6,11 @@ import time
 import pandas as pd
 import logging
 
+try:
+    from dbsql.llm.gateway import get_gateway
+except ImportError: # 未安装 dbsql 时直接使用 requests 调用
+    get_gateway = None
+
 # --- 配置常量 ---
 # 建议将这些配置移到单独的配置文件或环境变量中
 OLLAMA_API_BASE_URL = "https://u354342-baf8-f3ff1b79.bjc1.seetacloud.com:8443" # 你的API地址
@@ -142,6 +147,7 @@ def extract_and_parse_json(llm_output_text: str) -> dict | None:
 
 class OllamaClient:
     def __init__(self, base_url: str, model: str = DEFAULT_MODEL_NAME, max_retries: int = DEFAULT_MAX_RETRIES, timeout: int = DEFAULT_REQUEST_TIMEOUT):
+        self.base_url = base_url
         self.api_url = f"{base_url}/api/generate"
         self.model = model
         self.max_retries = max_retries
@@ -163,6 +169,10 @@ class OllamaClient:
             }
         }
         
+        if get_gateway is not None:
+            # 共享网关负责连接复用、并发限制和重试预算
+            return self._generate_via_gateway(prompt, payload["options"])
+
         last_exception = None
         for attempt in range(self.max_retries):
             logging.debug(f"向LLM发起请求 (尝试 {attempt + 1}/{self.max_retries})...")
@@ -212,6 +222,20 @@ class OllamaClient:
         logging.error(f"所有 ({self.max_retries}) 次尝试均失败。最后一次错误: {last_exception}")
         return None
 
+    def _generate_via_gateway(self, prompt: str, options: dict) -> dict | None:
+        try:
+            llm_output_text = get_gateway().ollama_generate(
+                self.base_url, self.model, prompt, options=options, timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            logging.error(f"LLM API 请求失败: {e}")
+            return None
+        if not llm_output_text:
+            logging.warning("LLM响应中缺少'response'字段或为空。")
+            return None
+        logging.debug(f"LLM原始输出 (部分): {llm_output_text[:300]}...")
+        return extract_and_parse_json(llm_output_text)
+
 
 def process_complaints_to_jsonl(datapath: str, output_jsonl_path: str, start_row: int, end_row: int):
     """
@@ -2,6 +2,11 @@ import json
 import mysql.connector
 import re # 用于正则表达式
 import os
+import sys
+
+# 与 dbsql 共用同一个数据版本号文件, 导入后结果缓存才会失效
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbsql-main"))
+from dbsql.epoch import bump_data_epoch
 
 # --- START: 配置部分 ---
 # MySQL 连接配置
@@ -281,6 +286,7 @@ def main():
 
         print(f"开始批量导入按类型分类的数据到数据库 '{MAIN_DB_NAME}' 的各个表中...")
         processed_file_count = 0
+        imported_file_count = 0
         for filename in dir_list:
             if filename.endswith(".jsonl"):
                 # 从文件名提取投诉类型 (文件名即 "类型名.jsonl")
@@ -291,13 +297,17 @@ def main():
                     continue
 
                 jsonl_full_path = os.path.join(classified_files_dir, filename)
-                create_and_populate_type_table(cursor_main_db, cnx_main_db, jsonl_full_path, complaint_type_name_from_file)
+                if create_and_populate_type_table(cursor_main_db, cnx_main_db, jsonl_full_path, complaint_type_name_from_file):
+                    imported_file_count += 1
                 processed_file_count +=1
             else:
                 print(f"跳过非 .jsonl 文件: {filename}")
         
         if processed_file_count == 0:
             print("在目录中没有找到 .jsonl 文件进行处理。")
+        if imported_file_count > 0:
+            # 数据已变化，使 Text2SQL 的答案缓存和 SQL 结果缓存失效
+            print(f"数据版本号已更新: {bump_data_epoch()}")
         print("\n所有文件处理完毕。")
 
     except mysql.connector.Error as err: